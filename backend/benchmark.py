@@ -0,0 +1,563 @@
+#benchmarks for the backend
+#usage: python benchmark.py concurrency [--requests 50] [--delay 0.2] [--simulate]
+#       python benchmark.py reservations --id 1 --date 2030-01-01 --turn 1 [--bookings 500] [--concurrency 200] [--batch]
+#       python benchmark.py serialization [--rows 10000] [--repeat 20]
+#       python benchmark.py seed [--database ristoranti_bench] [--restaurants 5000] [--users 200]
+#       DB_BACKEND=sqlite python benchmark.py seed|load [--sqlite-path ristoranti_bench.db] ...  (no MySQL server needed)
+#       python benchmark.py load [--database ristoranti_bench] [--requests 5000] [--concurrency 50] [--output report.json]
+#       python benchmark.py compare before.json after.json
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import httpx
+import mysql.connector
+
+import main
+import passwords
+
+
+#slow query executed inline on the event loop, like the handlers did before
+async def blocking_query(delay, simulate):
+    if simulate:
+        time.sleep(delay)
+        return
+    with main.db_cursor() as (conn, cursor):
+        cursor.execute("SELECT SLEEP(%s)", (delay,))
+        cursor.fetchall()
+
+
+#same slow query through the async-safe db layer
+async def offloaded_query(delay, simulate):
+    if simulate:
+        await main.run_in_db_executor(time.sleep, delay)
+        return
+    await main.db_fetchall("SELECT SLEEP(%s)", (delay,))
+
+
+async def run_concurrent(query, requests, delay, simulate):
+    start = time.perf_counter()
+    await asyncio.gather(*(query(delay, simulate) for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {"requests": requests, "seconds": round(elapsed, 3), "req_per_sec": round(requests / elapsed, 2)}
+
+
+def concurrency(args):
+    async def bench():
+        before = await run_concurrent(blocking_query, args.requests, args.delay, args.simulate)
+        after = await run_concurrent(offloaded_query, args.requests, args.delay, args.simulate)
+        return before, after
+
+    before, after = asyncio.run(bench())
+    print(f"slow query: {args.delay}s x {args.requests} concurrent requests, {main.DB_EXECUTOR_WORKERS} db workers")
+    print(f"before (inline):    {before['seconds']:>8}s  {before['req_per_sec']:>8} req/s")
+    print(f"after  (offloaded): {after['seconds']:>8}s  {after['req_per_sec']:>8} req/s")
+
+
+LOADTEST_EMAIL = "loadtest@benchmark.local"
+
+
+#concurrent bookings on one slot, checks that posti_max is never exceeded
+def reservations(args):
+    async def book(semaphore, results):
+        async with semaphore:
+            try:
+                await main.reserve_seats(args.id, args.date, args.turn, args.seats, LOADTEST_EMAIL)
+                results["accepted"] += 1
+            except main.NotEnoughSeatsError:
+                results["rejected"] += 1
+            except main.MySQLError as err:
+                results["errors"] += 1
+                print(f"error: {err}")
+
+    main.RESERVATION_BATCH = args.batch
+
+    async def bench():
+        await main.create_reservation_slots()  # also warms up the pool
+        semaphore = asyncio.Semaphore(args.concurrency)
+        results = {"accepted": 0, "rejected": 0, "errors": 0}
+        start = time.perf_counter()
+        await asyncio.gather(*(book(semaphore, results) for _ in range(args.bookings)))
+        elapsed = time.perf_counter() - start
+
+        slot = (args.id, args.date, args.turn)
+        reserved = await main.db_fetchone(
+            "SELECT COALESCE(SUM(num_posti), 0) FROM prenota WHERE id_locale = %s AND data = %s AND id_turno = %s",
+            slot, dictionary=False,
+        )
+        max_seats = await main.db_fetchone("SELECT posti_max FROM locale WHERE id = %s", (args.id,), dictionary=False)
+        if args.cleanup:
+            await main.db_execute(
+                "DELETE FROM prenota WHERE mail_prenotazione = %s AND id_locale = %s AND data = %s AND id_turno = %s",
+                (LOADTEST_EMAIL,) + slot,
+            )
+            await main.db_execute("DELETE FROM prenota_slot WHERE id_locale = %s AND data = %s AND id_turno = %s", slot)
+        return results, elapsed, int(reserved[0]), int(max_seats[0])
+
+    results, elapsed, reserved, max_seats = asyncio.run(bench())
+    print(f"{args.bookings} bookings of {args.seats} seats, {args.concurrency} concurrent, slot {args.id}/{args.date}/{args.turn}")
+    print(f"accepted: {results['accepted']}  rejected: {results['rejected']}  errors: {results['errors']}")
+    print(f"reserved seats: {reserved} / posti_max {max_seats}  overbooked: {max(0, reserved - max_seats)}")
+    print(f"throughput: {args.bookings / elapsed:.1f} bookings/s ({elapsed:.2f}s)")
+    if args.batch:
+        print(f"batches: {main.reservation_batcher.stats()}")
+
+
+#restaurant listing rows like baseSQL returns them, plus DATE/DATETIME/TIME columns
+def generate_listing(rows):
+    return [{
+        "id_locale": i,
+        "nome_locale": f"Ristorante {i}",
+        "via_locale": "Via Roma",
+        "civico_locale": str(i % 200),
+        "posti_max_locale": 40 + i % 60,
+        "descrizione_locale": "Cucina tipica, " * 4,
+        "banner_locale": f"https://cdn.example.com/banner/{i}.jpg",
+        "id_comune": i % 8000,
+        "nome_comune": f"Comune {i % 8000}",
+        "id_provincia": i % 107,
+        "nome_provincia": f"Provincia {i % 107}",
+        "sigla_provincia": "FC",
+        "id_regione": i % 20,
+        "nome_regione": f"Regione {i % 20}",
+        "cf_admin": f"ADMCF{i:011d}",
+        "nome_admin": "Mario",
+        "cognome_admin": "Rossi",
+        "email_admin": f"admin{i}@example.com",
+        "piva_azienda": f"{i:011d}",
+        "nome_azienda": f"Azienda {i} srl",
+        "cf_imprenditore": f"IMPCF{i:011d}",
+        "img_url": f"https://cdn.example.com/img/{i}.jpg",
+        "img_count": Decimal(i % 12),
+        "nome_imprenditore": "Luigi",
+        "cognome_imprenditore": "Bianchi",
+        "telefono_imprenditore": "+39 0543 000000",
+        "aperto_dal": date(2020, 1, 1) + timedelta(days=i % 1000),
+        "aggiornato": datetime(2024, 5, 1, 12, 30) + timedelta(minutes=i),
+        "ora_apertura": timedelta(hours=12),
+    } for i in range(rows)]
+
+
+def _time_render(render, content, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = render(content)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000, len(body)
+
+
+#stdlib JSONResponse vs FastJSONResponse on a generated restaurant listing
+def serialization(args):
+    content = generate_listing(args.rows)
+    # JSONResponse cannot encode Decimal/date/timedelta at all: default=str is the cheapest stdlib stand-in
+    stdlib = lambda value: json.dumps(value, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":"), default=str).encode()
+    fast = main.FastJSONResponse.render
+    results = [("stdlib json (JSONResponse)", *_time_render(stdlib, content, args.repeat))]
+    if main.orjson is not None:
+        results.append(("FastJSONResponse (orjson)", *_time_render(lambda value: fast(None, value), content, args.repeat)))
+    orjson, main.orjson = main.orjson, None
+    results.append(("FastJSONResponse (stdlib fallback)", *_time_render(lambda value: fast(None, value), content, args.repeat)))
+    main.orjson = orjson
+
+    print(f"{args.rows} rows x {len(content[0])} columns, best of {args.repeat}")
+    for name, ms, size in results:
+        print(f"{name:<36} {ms:>9.2f} ms  {size / 1024:>9.0f} KiB")
+
+
+#synthetic dataset, in its own database (or sqlite file) so the real one is never touched
+BENCH_DATABASE = "ristoranti_bench"
+BENCH_SQLITE_PATH = "ristoranti_bench.db"
+BENCH_PASSWORD = "benchmark"
+
+#portable DDL, valid on both storage backends
+benchSchema = [
+    "CREATE TABLE regioni (id INT PRIMARY KEY, nome VARCHAR(64) NOT NULL)",
+    "CREATE TABLE province (id INT PRIMARY KEY, nome VARCHAR(64) NOT NULL, sigla CHAR(2) NOT NULL, id_regione INT NOT NULL)",
+    "CREATE TABLE comuni (id INT PRIMARY KEY, nome VARCHAR(64) NOT NULL, id_provincia INT NOT NULL)",
+    "CREATE TABLE imprenditore (cf CHAR(16) PRIMARY KEY, nome VARCHAR(64), cognome VARCHAR(64), telefono VARCHAR(32))",
+    "CREATE TABLE azienda (piva CHAR(11) PRIMARY KEY, nome VARCHAR(128), cf_imprenditore CHAR(16))",
+    "CREATE TABLE locale (id INT PRIMARY KEY, nome VARCHAR(128), via VARCHAR(128), civico VARCHAR(8), posti_max INT, "
+    "descrizione TEXT, banner VARCHAR(255), id_comune INT NOT NULL, piva_azienda CHAR(11) NOT NULL)",
+    "CREATE TABLE admin (cf CHAR(16) PRIMARY KEY, nome VARCHAR(64), cognome VARCHAR(64), email VARCHAR(128), "
+    "password VARCHAR(255), id_locale INT)",
+    "CREATE TABLE imgs (id INT PRIMARY KEY, url VARCHAR(255), id_locale INT NOT NULL)",
+    "CREATE TABLE turno (id INT PRIMARY KEY, ora_inizio TIME, ora_fine TIME)",
+    "CREATE TABLE cliente (mail VARCHAR(128) PRIMARY KEY, nome VARCHAR(64), cognome VARCHAR(64), password VARCHAR(255))",
+    "CREATE TABLE menu (id INT PRIMARY KEY, nome VARCHAR(64), id_locale INT NOT NULL)",
+    "CREATE TABLE piatto (id INT PRIMARY KEY, nome VARCHAR(128), descrizione TEXT, ingredienti TEXT, id_menu INT NOT NULL)",
+    "CREATE TABLE prenota ({autoincrement}, mail_prenotazione VARCHAR(128), data DATE, num_posti INT, id_turno INT, id_locale INT)",
+    "CREATE INDEX province_id_regione ON province (id_regione)",
+    "CREATE INDEX comuni_id_provincia ON comuni (id_provincia)",
+    "CREATE INDEX locale_id_comune ON locale (id_comune)",
+    "CREATE INDEX admin_id_locale ON admin (id_locale)",
+    "CREATE INDEX imgs_id_locale ON imgs (id_locale)",
+    "CREATE INDEX menu_id_locale ON menu (id_locale)",
+    "CREATE INDEX piatto_id_menu ON piatto (id_menu)",
+    "CREATE INDEX prenota_slot_key ON prenota (id_locale, data, id_turno)",
+]
+AUTOINCREMENT = {"mysql": "id INT AUTO_INCREMENT PRIMARY KEY", "sqlite": "id INTEGER PRIMARY KEY"}
+benchTables = ["prenota", "prenota_slot", "locale_summary", "piatto", "menu", "cliente", "turno", "imgs", "admin",
+               "locale", "azienda", "imprenditore", "comuni", "province", "regioni"]
+
+KINDS = ["Trattoria", "Osteria", "Pizzeria", "Ristorante", "Locanda", "Enoteca", "Bistrot", "Braceria"]
+NAMES = ["del Porto", "da Mario", "La Pergola", "Il Portico", "dei Mille", "al Castello", "Bella Napoli", "San Marco",
+         "del Borgo", "La Rocca", "Al Vecchio Mulino", "Sole Mio", "della Nonna", "Il Girasole", "Le Tre Sorelle"]
+DISHES = ["Tagliatelle al ragu", "Lasagne", "Risotto ai funghi", "Piadina", "Tortellini in brodo", "Cappelletti",
+          "Grigliata mista", "Fritto misto", "Tiramisu", "Pizza margherita", "Bistecca", "Zuppa inglese"]
+
+
+def generate_dataset(args):
+    rnd = random.Random(args.seed)
+    data = defaultdict(list)
+    data["regioni"] = [(r, f"Regione {r}") for r in range(1, args.regions + 1)]
+    provinces = args.regions * args.provinces
+    data["province"] = [(p, f"Provincia {p}", f"{chr(65 + p % 26)}{chr(65 + p // 26 % 26)}", (p - 1) % args.regions + 1)
+                        for p in range(1, provinces + 1)]
+    data["comuni"] = [(c, f"Comune {c}", (c - 1) % provinces + 1) for c in range(1, args.comuni + 1)]
+    data["turno"] = [(t, f"{10 + 2 * t}:00:00", f"{12 + 2 * t}:00:00") for t in range(1, args.turns + 1)]
+    menu_id = piatto_id = img_id = 0
+    for id in range(1, args.restaurants + 1):
+        cf, piva = f"IMP{id:013d}", f"{id:011d}"
+        data["imprenditore"].append((cf, "Luigi", f"Bianchi {id}", f"+39 0543 {id:06d}"))
+        data["azienda"].append((piva, f"Azienda {id} srl", cf))
+        data["locale"].append((
+            id, f"{rnd.choice(KINDS)} {rnd.choice(NAMES)} {id}", "Via Roma", str(rnd.randint(1, 200)), rnd.randint(20, 120),
+            "Cucina tipica, " * rnd.randint(1, 8), f"https://cdn.example.com/banner/{id}.jpg", rnd.randint(1, args.comuni), piva,
+        ))
+        data["admin"].append((f"ADM{id:013d}", "Mario", f"Rossi {id}", f"admin{id}@benchmark.local", "", id))
+        for _ in range(rnd.randint(0, 2 * args.imgs)):
+            img_id += 1
+            data["imgs"].append((img_id, f"https://cdn.example.com/img/{img_id}.jpg", id))
+        for m in range(rnd.randint(1, 2 * args.menus)):
+            menu_id += 1
+            data["menu"].append((menu_id, f"Menu {m + 1}", id))
+            for _ in range(rnd.randint(2, 2 * args.dishes)):
+                piatto_id += 1
+                data["piatto"].append((piatto_id, rnd.choice(DISHES), "Piatto della casa", "farina, uova, sale", menu_id))
+    password = passwords.hash_password(BENCH_PASSWORD)  # one hash for every user, bcrypt is slow on purpose
+    data["cliente"] = [(f"user{u}@benchmark.local", "Utente", f"Benchmark {u}", password) for u in range(1, args.users + 1)]
+    today = date.today()
+    for _ in range(args.reservations):
+        data["prenota"].append((
+            f"user{rnd.randint(1, args.users)}@benchmark.local", today + timedelta(days=rnd.randint(0, 30)),
+            rnd.randint(1, 4), rnd.randint(1, args.turns), rnd.randint(1, args.restaurants),
+        ))
+    return data
+
+
+benchInsertSQL = {
+    "regioni": "INSERT INTO regioni (id, nome) VALUES (%s, %s)",
+    "province": "INSERT INTO province (id, nome, sigla, id_regione) VALUES (%s, %s, %s, %s)",
+    "comuni": "INSERT INTO comuni (id, nome, id_provincia) VALUES (%s, %s, %s)",
+    "imprenditore": "INSERT INTO imprenditore (cf, nome, cognome, telefono) VALUES (%s, %s, %s, %s)",
+    "azienda": "INSERT INTO azienda (piva, nome, cf_imprenditore) VALUES (%s, %s, %s)",
+    "locale": "INSERT INTO locale (id, nome, via, civico, posti_max, descrizione, banner, id_comune, piva_azienda) "
+              "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+    "admin": "INSERT INTO admin (cf, nome, cognome, email, password, id_locale) VALUES (%s, %s, %s, %s, %s, %s)",
+    "imgs": "INSERT INTO imgs (id, url, id_locale) VALUES (%s, %s, %s)",
+    "turno": "INSERT INTO turno (id, ora_inizio, ora_fine) VALUES (%s, %s, %s)",
+    "cliente": "INSERT INTO cliente (mail, nome, cognome, password) VALUES (%s, %s, %s, %s)",
+    "menu": "INSERT INTO menu (id, nome, id_locale) VALUES (%s, %s, %s)",
+    "piatto": "INSERT INTO piatto (id, nome, descrizione, ingredienti, id_menu) VALUES (%s, %s, %s, %s, %s)",
+    "prenota": "INSERT INTO prenota (mail_prenotazione, data, num_posti, id_turno, id_locale) VALUES (%s, %s, %s, %s, %s)",
+}
+
+
+#points the sqlite backend at the benchmark file, never at the app's SQLITE_PATH
+def use_bench_sqlite(args):
+    if os.path.abspath(args.sqlite_path) == os.path.abspath(main.SQLITE_PATH):
+        raise SystemExit(f"refusing to use {args.sqlite_path}: it is the app's SQLITE_PATH, pick another --sqlite-path")
+    main.db_backend = main.SQLiteBackend(args.sqlite_path)
+    main.db_pool._connect = main.db_backend.connect
+
+
+#drops and recreates the benchmark database with a generated dataset, on the DB_BACKEND in use
+def seed(args):
+    if main.db_backend.name == "sqlite":
+        use_bench_sqlite(args)
+    data = generate_dataset(args)
+    backend = main.db_backend
+    if backend.name == "mysql":
+        conn = mysql.connector.connect(**dict(main.db_config, database=None))
+        cursor = conn.cursor()
+        cursor.execute(f"CREATE DATABASE IF NOT EXISTS `{args.database}`")
+        cursor.execute(f"USE `{args.database}`")
+    else:
+        conn = backend.connect()
+        cursor = conn.cursor()
+    for table in benchTables:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    for statement in benchSchema:
+        cursor.execute(statement.format(autoincrement=AUTOINCREMENT[backend.name]))
+    conn.commit()
+    for table, query in benchInsertSQL.items():
+        rows = data[table]
+        for start in range(0, len(rows), 1000):
+            cursor.executemany(query, rows[start:start + 1000])
+        conn.commit()
+        print(f"{table:<14} {len(rows):>9} rows")
+    cursor.close()
+    conn.close()
+
+
+#load test flows: each one is (name, method, path, params, json), name is the key in the report
+def _flow_signin(rnd, ctx):
+    email = f"user{rnd.randint(1, ctx['users'])}@benchmark.local"
+    return "signin", "POST", "/api/v1/signin", None, {"email": email, "password": BENCH_PASSWORD}
+
+
+def _flow_listing(rnd, ctx):
+    return "listing", "GET", "/api/v1/restaurant/all", {"limit": 50, "after": rnd.randint(0, ctx["restaurants"])}, None
+
+
+def _flow_search(rnd, ctx):
+    return "search", "GET", "/search_restaurants", {"q": rnd.choice(KINDS + NAMES)}, None
+
+
+def _flow_detail(rnd, ctx):
+    return "detail", "GET", "/api/v1/restaurant", {"id": rnd.randint(1, ctx["restaurants"])}, None
+
+
+def _flow_menu(rnd, ctx):
+    return "menu", "GET", "/api/v1/restaurant/menu", {"id": rnd.randint(1, ctx["restaurants"])}, None
+
+
+def _flow_availability(rnd, ctx):
+    return "availability", "GET", "/api/v1/tables/calendar", {"id": rnd.randint(1, ctx["restaurants"])}, None
+
+
+def _flow_reservation(rnd, ctx):
+    body = {
+        "id": rnd.randint(1, ctx["restaurants"]),
+        "date": (date.today() + timedelta(days=rnd.randint(0, 30))).isoformat(),
+        "turn": rnd.randint(1, ctx["turns"]),
+        "qt": rnd.randint(1, 4),
+        "email": f"user{rnd.randint(1, ctx['users'])}@benchmark.local",
+    }
+    return "reservation", "POST", "/api/v1/restaurant/reservation", None, body
+
+
+FLOWS = {
+    "signin": _flow_signin,
+    "listing": _flow_listing,
+    "search": _flow_search,
+    "detail": _flow_detail,
+    "menu": _flow_menu,
+    "availability": _flow_availability,
+    "reservation": _flow_reservation,
+}
+DEFAULT_MIX = "signin=1,listing=4,search=4,detail=6,menu=3,availability=3,reservation=2"
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in FLOWS:
+            raise SystemExit(f"unknown flow {name!r}, available: {', '.join(FLOWS)}")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, round(p / 100 * len(ordered)) - 1))]
+
+
+def summarize(latencies, statuses, errors, elapsed):
+    return {
+        "requests": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else None,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+        "max_ms": max(latencies) if latencies else None,
+        "status": dict(sorted(statuses.items())),
+        "errors": errors,
+    }
+
+
+# runs the startup hooks of the app, httpx ASGITransport does not send lifespan events
+async def _app_event(handlers):
+    for handler in handlers:
+        result = handler()
+        if asyncio.iscoroutine(result):
+            await result
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+#drives the api with a weighted mix of flows, in process by default or against --url
+def load(args):
+    weights = parse_mix(args.mix)
+    ctx = {"restaurants": args.restaurants, "users": args.users, "turns": args.turns}
+
+    async def bench():
+        if args.url:
+            client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        else:
+            if main.db_backend.name == "sqlite":
+                use_bench_sqlite(args)
+            main.db_config["database"] = args.database
+            await _app_event(main.app.router.on_startup)
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=args.timeout)
+
+        latencies, statuses, errors = defaultdict(list), defaultdict(lambda: defaultdict(int)), defaultdict(int)
+        names, flow_weights = list(weights), list(weights.values())
+        counter = iter(range(args.requests))
+        try:
+            login = await client.post("/api/v1/signin", json={"email": "user1@benchmark.local", "password": BENCH_PASSWORD})
+            login.raise_for_status()
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+            async def worker(number):
+                rnd = random.Random(args.seed * 1000 + number)
+                for _ in counter:
+                    name, method, path, params, body = FLOWS[rnd.choices(names, flow_weights)[0]](rnd, ctx)
+                    start = time.perf_counter()
+                    try:
+                        response = await client.request(method, path, params=params, json=body, headers=headers)
+                        statuses[name][str(response.status_code)] += 1
+                        if response.status_code >= 500:
+                            errors[name] += 1
+                    except httpx.HTTPError:
+                        statuses[name]["exception"] += 1
+                        errors[name] += 1
+                    latencies[name].append(round((time.perf_counter() - start) * 1000, 3))
+
+            start = time.perf_counter()
+            await asyncio.gather(*(worker(number) for number in range(args.concurrency)))
+            elapsed = time.perf_counter() - start
+        finally:
+            await client.aclose()
+            if not args.url:
+                await _app_event(main.app.router.on_shutdown)
+        return latencies, statuses, errors, elapsed
+
+    latencies, statuses, errors, elapsed = asyncio.run(bench())
+    total_statuses = defaultdict(int)
+    for counts in statuses.values():
+        for status, count in counts.items():
+            total_statuses[status] += count
+    report = {
+        "revision": _git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "config": {
+            "target": args.url or f"in-process ({main.db_backend.name}: {args.sqlite_path if main.db_backend.name == 'sqlite' else args.database})",
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "mix": weights,
+            "seed": args.seed,
+            "python": sys.version.split()[0],
+            "cpus": os.cpu_count(),
+        },
+        "total": summarize([ms for values in latencies.values() for ms in values], total_statuses, sum(errors.values()), elapsed),
+        "endpoints": {name: summarize(latencies[name], statuses[name], errors[name], elapsed) for name in sorted(latencies)},
+    }
+    print(f"{'endpoint':<14} {'requests':>9} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for name, row in list(report["endpoints"].items()) + [("total", report["total"])]:
+        print(f"{name:<14} {row['requests']:>9} {row['throughput']:>9} {row['p50_ms']:>9} {row['p95_ms']:>9} {row['p99_ms']:>9} {row['errors']:>7}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"report written to {args.output}")
+
+
+#latency and throughput deltas between two load reports
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    print(f"{before.get('revision')} -> {after.get('revision')}")
+    print(f"{'endpoint':<14} {'p50 ms':>18} {'p95 ms':>18} {'p99 ms':>18} {'req/s':>18}")
+    rows = [(name, before["endpoints"].get(name), after["endpoints"].get(name)) for name in sorted(after["endpoints"])]
+    for name, old, new in rows + [("total", before["total"], after["total"])]:
+        if old is None:
+            continue
+        cells = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput"):
+            change = f"{(new[key] - old[key]) / old[key] * 100:+.0f}%" if old[key] else "-"
+            cells.append(f"{new[key]} ({change})")
+        print(f"{name:<14} " + " ".join(f"{cell:>18}" for cell in cells))
+
+
+def add_dataset_arguments(parser):
+    parser.add_argument("--database", default=BENCH_DATABASE)
+    parser.add_argument("--sqlite-path", default=BENCH_SQLITE_PATH, help="benchmark file when DB_BACKEND=sqlite")
+    parser.add_argument("--restaurants", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backend benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    concurrency_parser = commands.add_parser("concurrency", help="throughput with a slow query, inline vs offloaded")
+    concurrency_parser.add_argument("--requests", type=int, default=50)
+    concurrency_parser.add_argument("--delay", type=float, default=0.2)
+    concurrency_parser.add_argument("--simulate", action="store_true", help="time.sleep in place of SELECT SLEEP, no database needed")
+    concurrency_parser.set_defaults(func=concurrency)
+
+    reservations_parser = commands.add_parser("reservations", help="overbooking load test on a single slot")
+    reservations_parser.add_argument("--id", type=int, required=True, help="id of an existing locale")
+    reservations_parser.add_argument("--date", required=True)
+    reservations_parser.add_argument("--turn", type=int, required=True)
+    reservations_parser.add_argument("--seats", type=int, default=2)
+    reservations_parser.add_argument("--bookings", type=int, default=500)
+    reservations_parser.add_argument("--concurrency", type=int, default=200)
+    reservations_parser.add_argument("--cleanup", action="store_true", help="delete the load test reservations afterwards")
+    reservations_parser.add_argument("--batch", action="store_true", help="group commit mode (RESERVATION_BATCH)")
+    reservations_parser.set_defaults(func=reservations)
+
+    serialization_parser = commands.add_parser("serialization", help="response rendering time on a generated listing")
+    serialization_parser.add_argument("--rows", type=int, default=10000)
+    serialization_parser.add_argument("--repeat", type=int, default=20)
+    serialization_parser.set_defaults(func=serialization)
+
+    seed_parser = commands.add_parser("seed", help="create the benchmark database with a synthetic dataset")
+    add_dataset_arguments(seed_parser)
+    seed_parser.add_argument("--regions", type=int, default=20)
+    seed_parser.add_argument("--provinces", type=int, default=5, help="per region")
+    seed_parser.add_argument("--comuni", type=int, default=2000)
+    seed_parser.add_argument("--imgs", type=int, default=3, help="average per restaurant")
+    seed_parser.add_argument("--menus", type=int, default=2, help="average per restaurant")
+    seed_parser.add_argument("--dishes", type=int, default=5, help="average per menu")
+    seed_parser.add_argument("--reservations", type=int, default=20000)
+    seed_parser.set_defaults(func=seed)
+
+    load_parser = commands.add_parser("load", help="load test of the api on the seeded database, p50/p95/p99 per endpoint")
+    add_dataset_arguments(load_parser)
+    load_parser.add_argument("--requests", type=int, default=5000)
+    load_parser.add_argument("--concurrency", type=int, default=50)
+    load_parser.add_argument("--mix", default=DEFAULT_MIX, help="flow weights, name=weight comma separated")
+    load_parser.add_argument("--url", help="base url of a running server, default is the app in process")
+    load_parser.add_argument("--timeout", type=float, default=30)
+    load_parser.add_argument("--output", help="write the JSON report here")
+    load_parser.set_defaults(func=load)
+
+    compare_parser = commands.add_parser("compare", help="diff two load reports")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,7 @@
+#the tests run on the sqlite backend in a temporary file (no MySQL server needed), set before main is imported
+import os
+import tempfile
+
+os.environ["DB_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["SHARED_STATE_PATH"] = ""
@@ -1,41 +1,416 @@
-from collections import defaultdict
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing, contextmanager
+from types import MappingProxyType
 from typing import List
 from fastapi import FastAPI, Request, HTTPException, Depends, Query, Header, status
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordBearer
+from starlette.routing import Match
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from datetime import datetime, timedelta
+from datetime import date, datetime, time as datetime_time, timedelta
+from decimal import Decimal
 import mysql.connector
 from mysql.connector import Error as MySQLError 
+from mysql.connector import errorcode
+from mysql.connector.errors import PoolError
+import asyncio
+import bisect
+import hashlib
+import json
 import logging
-from functools import wraps
+import multiprocessing
+from functools import lru_cache, wraps
 from pydantic import BaseModel
+from passwords import hash_password, verify_password
 import sqlite3
 import secrets
 import os
-
-
-app = FastAPI()
+import re
+import threading
+import time
+import unicodedata
+
+
+# orjson is optional, without it the stdlib encoder is used with the same conversions
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# MySQL values the encoders do not handle natively
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if isinstance(value, (datetime, date, datetime_time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        # TIME columns come back as timedelta
+        seconds = int(value.total_seconds())
+        sign = "-" if seconds < 0 else ""
+        hours, rest = divmod(abs(seconds), 3600)
+        return f"{sign}{hours:02d}:{rest // 60:02d}:{rest % 60:02d}"
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, MappingProxyType):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def json_dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_json_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+# response class used by every route
+class FastJSONResponse(JSONResponse):
+    def render(self, content):
+        return json_dumps(content)
+
+
+app = FastAPI(default_response_class=FastJSONResponse)
+
+#Password hashing configuration, BCRYPT_ROUNDS is read by passwords.py
+PASSWORD_WORKERS = int(os.environ.get("PASSWORD_WORKERS", os.cpu_count() or 1))
+PASSWORD_QUEUE_LIMIT = int(os.environ.get("PASSWORD_QUEUE_LIMIT", 64))
 
 # Configurazione OAuth2
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# Configurazione CORS
+#Logging service
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+#Metrics, Prometheus text format on /metrics
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "1").lower() in ("1", "true", "yes")
+METRICS_BUCKETS = tuple(float(b) for b in os.environ.get(
+    "METRICS_BUCKETS", "0.001,0.0025,0.005,0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10").split(","))
+
+#Admission control, the one place where route priorities and limits are set.
+#Every class has its own concurrency limit, wait queue and queue deadline (seconds); all of them share
+#ADMISSION_CAPACITY and a freed slot goes to the waiting class with the lowest priority number.
+#Browsing is capped below the capacity so reservations and signins always find room.
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "1").lower() in ("1", "true", "yes")
+ADMISSION_CAPACITY = int(os.environ.get("ADMISSION_CAPACITY", 64))
+ADMISSION_CLASSES = {
+    "reservation": {"priority": 0, "limit": 64, "queue": 256, "timeout": 5.0, "retry_after": 1},
+    "auth": {"priority": 1, "limit": 32, "queue": 128, "timeout": 5.0, "retry_after": 2},
+    "browse": {"priority": 2, "limit": 40, "queue": 128, "timeout": 2.0, "retry_after": 5},
+}
+# route templates to classes, unlisted routes are "browse", None is never queued
+ADMISSION_ROUTES = {
+    "/api/v1/restaurant/reservation": "reservation",
+    "/api/v1/signin": "auth",
+    "/api/v1/signup": "auth",
+    "/api/v1/verify_token": "auth",
+    "/ping": None,
+    "/metrics": None,
+    "/api/v1/stats": None,
+}
+ADMISSION_DEFAULT_CLASS = "browse"
+# overrides as JSON, e.g. ADMISSION_CONFIG='{"browse": {"limit": 20}}'
+for _name, _override in json.loads(os.environ.get("ADMISSION_CONFIG", "{}")).items():
+    ADMISSION_CLASSES.setdefault(_name, {}).update(_override)
+ADMISSION_ROUTES.update(json.loads(os.environ.get("ADMISSION_ROUTES", "{}")))
+
+#Multi-worker coherence: invalidation log shared by the workers of one node (sqlite file, ideally on /dev/shm)
+SHARED_STATE_PATH = os.environ.get("SHARED_STATE_PATH", "")
+SHARED_STATE_POLL = float(os.environ.get("SHARED_STATE_POLL", 0.25))
+SHARED_STATE_RETENTION = float(os.environ.get("SHARED_STATE_RETENTION", 300))
+
+#Slow query log, statements over the threshold kept in a ring buffer with their EXPLAIN
+SLOW_QUERY_LOG = os.environ.get("SLOW_QUERY_LOG", "1").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", 200))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get("SLOW_QUERY_LOG_SIZE", 200))
+SLOW_QUERY_SHAPES = int(os.environ.get("SLOW_QUERY_SHAPES", 500))
+SLOW_QUERY_EXPLAIN = os.environ.get("SLOW_QUERY_EXPLAIN", "1").lower() in ("1", "true", "yes")
+
+
+def _metric_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+# metrics keep one series per tuple of label values, updated under a lock (db threads and event loop)
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] += amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, _metric_labels(self.labels, labels), value) for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=METRICS_BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # labels -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def samples(self):
+        with self._lock:
+            series = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        result = []
+        for labels, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = bound if bound == "+Inf" else repr(bound)
+                result.append((self.name + "_bucket", _metric_labels(self.labels + ("le",), labels + (le,)), cumulative))
+            result.append((self.name + "_sum", _metric_labels(self.labels, labels), total))
+            result.append((self.name + "_count", _metric_labels(self.labels, labels), cumulative))
+        return result
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []  # callables returning metrics built at scrape time
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics + [m for collect in self.collectors for m in collect()]:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{name}{labels} {value}" for name, labels, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+http_requests_in_flight = metrics.register(Gauge("http_requests_in_flight", "Requests being served"))
+http_request_duration = metrics.register(Histogram(
+    "http_request_duration_seconds", "Request latency by route template", ("method", "route")))
+http_responses = metrics.register(Counter("http_responses_total", "Responses by route and status", ("method", "route", "status")))
+db_query_duration = metrics.register(Histogram(
+    "db_query_duration_seconds", "Query execution and fetch time by named query", ("query",)))
+db_query_errors = metrics.register(Counter("db_query_errors_total", "Failed queries by named query", ("query",)))
+db_pool_acquire_duration = metrics.register(Histogram(
+    "db_pool_acquire_seconds", "Time waited for a pooled connection"))
+
+
+# pure ASGI middleware: latency is labelled with the route template, not the raw path
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_requests_in_flight.dec()
+            route = scope.get("route")
+            # unmatched paths share one label, so scanners cannot blow up the series count
+            route = getattr(route, "path", "unmatched")
+            http_request_duration.observe(time.perf_counter() - start, scope["method"], route)
+            http_responses.inc(scope["method"], route, str(status))
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+
+
+class AdmissionClass:
+    def __init__(self, name, priority, limit, queue, timeout, retry_after):
+        self.name = name
+        self.priority = priority
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = deque()  # futures, resolved when a slot is handed over
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0  # rejected on arrival, queue full
+        self.expired = 0  # rejected after waiting past the deadline
+        self.max_waiting = 0
+
+
+# event loop only: acquire/release are never called from the db threads
+class AdmissionController:
+    def __init__(self, capacity, classes):
+        self.capacity = capacity
+        self.active = 0
+        self.classes = {name: AdmissionClass(name, **config) for name, config in classes.items()}
+        self._by_priority = sorted(self.classes.values(), key=lambda c: c.priority)
+
+    def _can_run(self, cls):
+        return cls.active < cls.limit and self.active < self.capacity
+
+    def _admit(self, cls):
+        cls.active += 1
+        cls.admitted += 1
+        self.active += 1
+
+    async def acquire(self, name):
+        cls = self.classes[name]
+        if not cls.waiting and self._can_run(cls):
+            self._admit(cls)
+            return
+        if len(cls.waiting) >= cls.queue:
+            cls.shed += 1
+            raise AdmissionRejected(cls.retry_after)
+        future = asyncio.get_running_loop().create_future()
+        cls.waiting.append(future)
+        cls.queued += 1
+        cls.max_waiting = max(cls.max_waiting, len(cls.waiting))
+        try:
+            await asyncio.wait_for(future, cls.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # slot handed over just as the deadline hit: give it back
+                self.release(name)
+            else:
+                try:
+                    cls.waiting.remove(future)
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            cls.expired += 1
+            raise AdmissionRejected(cls.retry_after)
+
+    def release(self, name):
+        cls = self.classes[name]
+        cls.active -= 1
+        self.active -= 1
+        # freed capacity goes to the highest priority class that can use it
+        for candidate in self._by_priority:
+            while candidate.waiting and self._can_run(candidate):
+                future = candidate.waiting.popleft()
+                if future.done():
+                    continue
+                self._admit(candidate)
+                future.set_result(None)
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "active": self.active,
+            "classes": {
+                name: {
+                    "priority": cls.priority,
+                    "limit": cls.limit,
+                    "active": cls.active,
+                    "waiting": len(cls.waiting),
+                    "max_waiting": cls.max_waiting,
+                    "queue": cls.queue,
+                    "admitted": cls.admitted,
+                    "queued": cls.queued,
+                    "shed": cls.shed,
+                    "expired": cls.expired,
+                }
+                for name, cls in self.classes.items()
+            },
+        }
+
+
+admission = AdmissionController(ADMISSION_CAPACITY, ADMISSION_CLASSES)
+
+
+# matches the route the router will pick, to queue the request by its class before any work is done
+class AdmissionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    def _route_class(self, scope):
+        for route in scope["app"].router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                # the metrics middleware labels shed requests by this route too
+                scope["route"] = route
+                return ADMISSION_ROUTES.get(route.path, ADMISSION_DEFAULT_CLASS)
+        return None
+
+    async def __call__(self, scope, receive, send):
+        name = self._route_class(scope) if scope["type"] == "http" else None
+        if name is None:
+            return await self.app(scope, receive, send)
+        try:
+            await admission.acquire(name)
+        except AdmissionRejected as e:
+            response = FastJSONResponse(
+                content={"error": "Server busy, retry later"},
+                status_code=503,
+                headers={"Retry-After": str(e.retry_after)},
+            )
+            return await response(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(name)
+
+
+# added before the metrics middleware, so shed requests are still measured
+if ADMISSION_ENABLED:
+    app.add_middleware(AdmissionMiddleware)
+
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+
+# Configurazione CORS, added last so it is the outermost middleware and 503s from admission carry its headers too
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE","PATCH"],
     allow_headers=["*"],
+    expose_headers=["X-Next-After"],  # keyset pagination cursor, read by the frontend
 )
 
-#Logging service
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
 #Db configuration
 db_config = {
     'host': "localhost",
@@ -45,22 +420,813 @@ db_config = {
     'port': 3306
 }
 
-#Token generation
-SECRET_KEY = secrets.token_urlsafe(32)
+#Storage backend: "mysql" (db_config) or "sqlite" (single file, for one-node sites and local benchmarks)
+DB_BACKEND = os.environ.get("DB_BACKEND", "mysql").lower()
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "ristoranti.db")
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024))
+SQLITE_CACHED_STATEMENTS = int(os.environ.get("SQLITE_CACHED_STATEMENTS", 256))
+SQLITE_BUSY_TIMEOUT = float(os.environ.get("SQLITE_BUSY_TIMEOUT", 5))
+
+#Db connection pool configuration
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 20))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5))
+DB_POOL_RECYCLE = float(os.environ.get("DB_POOL_RECYCLE", 300))
+
+#Db query execution configuration
+DB_EXECUTOR_WORKERS = int(os.environ.get("DB_EXECUTOR_WORKERS", DB_POOL_MAX_SIZE))
+DB_QUERY_TIMEOUT = float(os.environ.get("DB_QUERY_TIMEOUT", 10))
+
+#Token generation: signing keys by kid, from a JSON keyfile {"active": kid, "keys": {kid: secret}}
+#or JWT_KEYS="kid:secret,kid:secret"; tokens are signed with the active kid, verified with any listed one
+JWT_KEYFILE = os.environ.get("JWT_KEYFILE", "")
+JWT_KEYS = os.environ.get("JWT_KEYS", "")
+JWT_ACTIVE_KID = os.environ.get("JWT_ACTIVE_KID", "")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 240
+#Admin endpoints need X-Admin-Token on top of a user token, disabled while ADMIN_TOKEN is unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+
+#Single-flight: concurrent identical reads share one query
+SINGLE_FLIGHT_ENABLED = os.environ.get("SINGLE_FLIGHT_ENABLED", "1").lower() in ("1", "true", "yes")
+
+#Restaurant cache configuration
+RESTAURANT_CACHE_SIZE = int(os.environ.get("RESTAURANT_CACHE_SIZE", 5000))
+RESTAURANT_CACHE_TTL = float(os.environ.get("RESTAURANT_CACHE_TTL", 3600))
+RESTAURANT_CACHE_MAX_BYTES = int(os.environ.get("RESTAURANT_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+#Restaurant listing pagination
+RESTAURANT_PAGE_SIZE = int(os.environ.get("RESTAURANT_PAGE_SIZE", 50))
+RESTAURANT_PAGE_MAX = int(os.environ.get("RESTAURANT_PAGE_MAX", 500))
+RESTAURANT_STREAM_BATCH = int(os.environ.get("RESTAURANT_STREAM_BATCH", 500))
+
+#Restaurant search
+SEARCH_LIMIT = int(os.environ.get("SEARCH_LIMIT", 50))
+SEARCH_LIMIT_MAX = int(os.environ.get("SEARCH_LIMIT_MAX", 500))
+
+#Restaurant batch lookups
+RESTAURANT_BATCH_MAX = int(os.environ.get("RESTAURANT_BATCH_MAX", 200))
+RESTAURANT_BATCH_CHUNK = int(os.environ.get("RESTAURANT_BATCH_CHUNK", 500))
+
+#Seat availability counters
+SEAT_COUNTERS_RECONCILE_SECONDS = float(os.environ.get("SEAT_COUNTERS_RECONCILE_SECONDS", 60))
+SEAT_COUNTERS_MAX_SLOTS = int(os.environ.get("SEAT_COUNTERS_MAX_SLOTS", 100000))
+CALENDAR_MAX_DAYS = int(os.environ.get("CALENDAR_MAX_DAYS", 62))
+
+#Reference data (turno, regioni, province, comuni) client cache lifetime
+REFERENCE_MAX_AGE = int(os.environ.get("REFERENCE_MAX_AGE", 300))
+
+#Menu cache configuration
+MENU_CACHE_SIZE = int(os.environ.get("MENU_CACHE_SIZE", 5000))
+MENU_CACHE_TTL = float(os.environ.get("MENU_CACHE_TTL", 3600))
+MENU_CACHE_MAX_BYTES = int(os.environ.get("MENU_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+MENU_BATCH_MAX = int(os.environ.get("MENU_BATCH_MAX", 100))
+RESERVATION_RETRIES = int(os.environ.get("RESERVATION_RETRIES", 5))
+
+#Reservation group commit, off by default
+RESERVATION_BATCH = os.environ.get("RESERVATION_BATCH", "0").lower() in ("1", "true", "yes")
+RESERVATION_BATCH_WINDOW_MS = float(os.environ.get("RESERVATION_BATCH_WINDOW_MS", 5))
+RESERVATION_BATCH_MAX = int(os.environ.get("RESERVATION_BATCH_MAX", 50))
+
+
+# db connection pool
+class ConnectionPool:
+    def __init__(self, connect, min_size=1, max_size=10, timeout=5, recycle=300):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.recycle = recycle
+        self._idle = deque()  # (conn, last_used), most recently used on the right
+        self._size = 0
+        self._cond = threading.Condition()
+
+    def _open(self):
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+
+    def _discard(self, conn):
+        _close_quietly(conn)
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    # opens the minimum number of connections ahead of the first requests
+    def fill(self):
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            self.release(self._open())
+
+    def acquire(self):
+        start = time.perf_counter()
+        try:
+            return self._acquire()
+        finally:
+            if METRICS_ENABLED:
+                db_pool_acquire_duration.observe(time.perf_counter() - start)
+
+    def _acquire(self):
+        deadline = time.monotonic() + self.timeout
+        while True:
+            conn = None
+            stale = []
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    if self._idle:
+                        conn, last_used = self._idle.pop()
+                        if now - last_used <= self.recycle:
+                            break
+                        # idle for too long: recycled and its slot freed
+                        stale.append(conn)
+                        conn = None
+                        self._size -= 1
+                        continue
+                    if self._size < self.max_size:
+                        self._size += 1
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise PoolError("Connection pool exhausted")
+                    self._cond.wait(remaining)
+            for candidate in stale:
+                _close_quietly(candidate)
+            if conn is None:
+                return self._open()
+            # health check on checkout, broken connections are replaced
+            if _is_connection_usable(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn, discard=False):
+        if not discard:
+            try:
+                # ends the implicit transaction so the next user gets a fresh snapshot
+                conn.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException:
+            self.release(conn, discard=not _is_connection_usable(conn))
+            raise
+        self.release(conn)
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, deque()
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._size - len(self._idle),
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+            }
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _is_connection_usable(conn):
+    try:
+        return conn.is_connected()
+    except Exception:
+        return False
+
+
+def _connect_mysql():
+    conn = mysql.connector.connect(**db_config)
+    # server side cap, so a query abandoned by its timeout does not keep running forever
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET SESSION max_execution_time = %s", (int(DB_QUERY_TIMEOUT * 1000),))
+    except MySQLError as e:
+        logger.warning(f"Could not set max_execution_time: {e}")
+    finally:
+        cursor.close()
+    return conn
+
+
+# dialect specific statements, everything else is shared SQL
+class MySQLBackend:
+    name = "mysql"
+    explainPrefix = "EXPLAIN "
+    # the session max_execution_time would cut long streams, the hint lifts it for one statement
+    streamSelect = "SELECT /*+ MAX_EXECUTION_TIME(0) */"
+    takeSeatsSQL = (
+        "UPDATE prenota_slot s INNER JOIN locale l ON l.id = s.id_locale "
+        "SET s.posti_prenotati = s.posti_prenotati + %s "
+        "WHERE s.id_locale = %s AND s.data = %s AND s.id_turno = %s AND s.posti_prenotati + %s <= l.posti_max"
+    )
+
+    def connect(self):
+        return _connect_mysql()
+
+    # CREATE TABLE ... SELECT with its keys, select is expected to return no rows
+    def create_table_as(self, cursor, table, select, primary_key, indexes=()):
+        keys = [f"PRIMARY KEY ({', '.join(primary_key)})"] + [f"KEY ({', '.join(columns)})" for columns in indexes]
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(keys)}) {select}")
+
+
+# %s placeholders to ?, outside quoted literals ('%H:%i:%s' in the turns query stays as it is)
+@lru_cache(maxsize=1024)
+def _sqlite_statement(query):
+    parts = []
+    quote = None
+    i = 0
+    while i < len(query):
+        char = query[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"', "`"):
+            quote = char
+        elif query.startswith("%s", i):
+            parts.append("?")
+            i += 2
+            continue
+        parts.append(char)
+        i += 1
+    query = "".join(parts)
+    return re.sub(r"^\s*INSERT\s+IGNORE\b", "INSERT OR IGNORE", query, flags=re.IGNORECASE)
+
+
+_SQLITE_WRITE = re.compile(r"\s*(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER)\b", re.IGNORECASE)
+_MYSQL_TIME_FORMAT = {"%H": "{h:02d}", "%k": "{h}", "%i": "{m:02d}", "%s": "{s:02d}", "%S": "{s:02d}"}
+
+
+# MySQL TIME_FORMAT for TIME values stored as HH:MM[:SS] text
+def _sqlite_time_format(value, fmt):
+    if value is None:
+        return None
+    h, m, s = (int(float(part)) for part in (str(value).split(":") + ["0", "0"])[:3])
+    return re.sub(r"%[a-zA-Z]", lambda match: _MYSQL_TIME_FORMAT.get(match.group(), match.group()).format(h=h, m=m, s=s), fmt)
+
+
+# sqlite errors raised as mysql.connector ones, so every endpoint handles both backends the same way;
+# a busy database maps to a lock wait timeout and gets the reservation retries
+@contextmanager
+def _sqlite_errors():
+    try:
+        yield
+    except sqlite3.IntegrityError as e:
+        raise mysql.connector.errors.IntegrityError(msg=str(e)) from e
+    except sqlite3.OperationalError as e:
+        busy = "locked" in str(e) or "busy" in str(e)
+        raise mysql.connector.errors.OperationalError(
+            msg=str(e), errno=errorcode.ER_LOCK_WAIT_TIMEOUT if busy else None) from e
+    except sqlite3.Error as e:
+        raise mysql.connector.errors.DatabaseError(msg=str(e)) from e
+
+
+class SQLiteCursor:
+    def __init__(self, conn, dictionary=False):
+        self._conn = conn
+        self._cursor = conn.raw.cursor()
+        self._dictionary = dictionary
+
+    def execute(self, query, params=()):
+        query = _sqlite_statement(query)
+        if _SQLITE_WRITE.match(query):
+            self._conn.begin_write()
+        with _sqlite_errors():
+            self._cursor.execute(query, tuple(params or ()))
+
+    def executemany(self, query, seq_params):
+        query = _sqlite_statement(query)
+        if _SQLITE_WRITE.match(query):
+            self._conn.begin_write()
+        with _sqlite_errors():
+            self._cursor.executemany(query, [tuple(params) for params in seq_params])
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip((column[0] for column in self._cursor.description), row))
+
+    def fetchone(self):
+        with _sqlite_errors():
+            return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size=1):
+        with _sqlite_errors():
+            return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        with _sqlite_errors():
+            return [self._row(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+# mysql.connector-like connection: readers run concurrently on WAL snapshots, writes take
+# the process wide writer lock for the whole transaction (BEGIN IMMEDIATE .. COMMIT/ROLLBACK)
+class SQLiteConnection:
+    def __init__(self, raw, write_lock, timeout):
+        self.raw = raw
+        self._write_lock = write_lock
+        self._timeout = timeout
+        self._writing = False
+        self._closed = False
+
+    def cursor(self, dictionary=False):
+        return SQLiteCursor(self, dictionary)
+
+    def begin_write(self):
+        if self._writing:
+            return
+        if not self._write_lock.acquire(timeout=self._timeout):
+            raise mysql.connector.errors.OperationalError(msg="Timed out waiting for the sqlite writer", errno=errorcode.ER_LOCK_WAIT_TIMEOUT)
+        self._writing = True
+        try:
+            with _sqlite_errors():
+                self.raw.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            self._end_write()
+            raise
+
+    def _end_write(self):
+        if self._writing:
+            self._writing = False
+            self._write_lock.release()
+
+    def commit(self):
+        try:
+            with _sqlite_errors():
+                if self.raw.in_transaction:
+                    self.raw.commit()
+        finally:
+            self._end_write()
+
+    def rollback(self):
+        try:
+            with _sqlite_errors():
+                if self.raw.in_transaction:
+                    self.raw.rollback()
+        finally:
+            self._end_write()
+
+    def is_connected(self):
+        return not self._closed
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            try:
+                self.rollback()
+            finally:
+                self.raw.close()
+
+
+class SQLiteBackend:
+    name = "sqlite"
+    explainPrefix = "EXPLAIN QUERY PLAN "
+    streamSelect = "SELECT"
+    # no UPDATE ... JOIN in sqlite, posti_max comes from a correlated subquery
+    takeSeatsSQL = (
+        "UPDATE prenota_slot SET posti_prenotati = posti_prenotati + %s "
+        "WHERE id_locale = %s AND data = %s AND id_turno = %s "
+        "AND posti_prenotati + %s <= (SELECT posti_max FROM locale WHERE id = prenota_slot.id_locale)"
+    )
+
+    def __init__(self, path):
+        self.path = path
+        self.write_lock = threading.Lock()
+        # explicit adapters, the default date ones are deprecated
+        sqlite3.register_adapter(date, date.isoformat)
+        sqlite3.register_adapter(datetime, lambda value: value.isoformat(" "))
+        sqlite3.register_adapter(Decimal, str)
+        with closing(sqlite3.connect(self.path)) as conn:
+            # persistent, set once for the database file
+            conn.execute("PRAGMA journal_mode = WAL")
+
+    def connect(self):
+        with _sqlite_errors():
+            raw = sqlite3.connect(
+                self.path,
+                timeout=SQLITE_BUSY_TIMEOUT,
+                isolation_level=None,  # transactions are opened by SQLiteConnection.begin_write
+                check_same_thread=False,  # pooled, used by one db thread at a time
+                cached_statements=SQLITE_CACHED_STATEMENTS,
+            )
+            raw.execute("PRAGMA synchronous = NORMAL")
+            raw.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+            raw.execute("PRAGMA temp_store = MEMORY")
+            raw.create_function("TIME_FORMAT", 2, _sqlite_time_format, deterministic=True)
+        return SQLiteConnection(raw, self.write_lock, SQLITE_BUSY_TIMEOUT)
+
+    def create_table_as(self, cursor, table, select, primary_key, indexes=()):
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} AS {select}")
+        cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_pk ON {table} ({', '.join(primary_key)})")
+        for columns in indexes:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_{'_'.join(columns)} ON {table} ({', '.join(columns)})")
+
+
+db_backend = SQLiteBackend(SQLITE_PATH) if DB_BACKEND == "sqlite" else MySQLBackend()
+
+db_pool = ConnectionPool(
+    db_backend.connect,
+    min_size=DB_POOL_MIN_SIZE,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    recycle=DB_POOL_RECYCLE,
+)
+
+
+# literals and placeholder lists collapsed, so every IN (...) length or filter value maps to one shape
+_SQL_NORMALIZE = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), "?"),
+    (re.compile(r'"(?:[^"\\]|\\.)*"'), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    (re.compile(r"%s"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def normalize_sql(query):
+    for pattern, replacement in _SQL_NORMALIZE:
+        query = pattern.sub(replacement, query)
+    return query.strip()
+
+
+_EXPLAINABLE = re.compile(r"\s*(SELECT|INSERT|UPDATE|DELETE|REPLACE)\b", re.IGNORECASE)
+
+
+def _param_count(params, many=False):
+    if not params:
+        return 0
+    if many:
+        return sum(len(row) for row in params)
+    return len(params)
+
+
+class SlowQueryLog:
+    def __init__(self, threshold_ms, size, max_shapes):
+        self.threshold = threshold_ms / 1000
+        self.max_shapes = max_shapes
+        self.recent = deque(maxlen=size)
+        self.shapes = OrderedDict()  # normalized sql -> aggregate, least recently slow first
+        self._lock = threading.Lock()
+
+    def record(self, name, query, params, rowcount, elapsed, many=False):
+        shape = normalize_sql(query)
+        entry = {
+            "at": datetime.now().isoformat(timespec="milliseconds"),
+            "name": name,
+            "sql": shape,
+            "ms": round(elapsed * 1000, 3),
+            "params": _param_count(params, many),
+            "rows": rowcount,
+        }
+        with self._lock:
+            self.recent.append(entry)
+            aggregate = self.shapes.pop(shape, None)
+            new_shape = aggregate is None
+            if new_shape:
+                aggregate = {"sql": shape, "name": name, "count": 0, "total_ms": 0.0, "max_ms": 0.0,
+                             "first_seen": entry["at"], "explain": None}
+                while len(self.shapes) >= self.max_shapes:
+                    self.shapes.popitem(last=False)
+            aggregate["count"] += 1
+            aggregate["total_ms"] += entry["ms"]
+            aggregate["max_ms"] = max(aggregate["max_ms"], entry["ms"])
+            aggregate["last_seen"] = entry["at"]
+            self.shapes[shape] = aggregate
+        logger.warning(f"Slow query {name} ({entry['ms']} ms, {entry['rows']} rows): {shape}")
+        if new_shape and SLOW_QUERY_EXPLAIN and not many and _EXPLAINABLE.match(query):
+            # captured on another pooled connection, the request that ran the query does not wait for it
+            try:
+                db_executor.submit(self._explain, shape, query, params)
+            except RuntimeError:
+                pass  # executor shut down
+
+    def _explain(self, shape, query, params):
+        try:
+            # plain cursor: the EXPLAIN itself is never timed or logged
+            with db_pool.connection() as conn:
+                cursor = conn.cursor(dictionary=True)
+                try:
+                    cursor.execute(db_backend.explainPrefix + query, params)
+                    plan = cursor.fetchall()
+                finally:
+                    cursor.close()
+        except Exception as e:
+            plan = {"error": str(e)}
+        with self._lock:
+            if shape in self.shapes:
+                self.shapes[shape]["explain"] = plan
+
+    def snapshot(self):
+        with self._lock:
+            shapes = sorted((dict(aggregate) for aggregate in self.shapes.values()), key=lambda a: a["total_ms"], reverse=True)
+            return {"threshold_ms": self.threshold * 1000, "shapes": shapes, "recent": list(reversed(self.recent))}
+
+    def clear(self):
+        with self._lock:
+            self.recent.clear()
+            self.shapes.clear()
+
+
+slow_query_log = SlowQueryLog(SLOW_QUERY_MS, SLOW_QUERY_LOG_SIZE, SLOW_QUERY_SHAPES)
+
+
+# cursor timing its queries under a name, execute plus fetch time of each query;
+# feeds the query metrics and the slow query log
+class MeteredCursor:
+    def __init__(self, cursor, name):
+        self._cursor = cursor
+        self.name = name
+        self._elapsed = None
+        self._statement = None  # (query, params, many) of the running query
+
+    def _timed(self, method, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            db_query_errors.inc(self.name)
+            raise
+        finally:
+            self._elapsed = (self._elapsed or 0.0) + time.perf_counter() - start
+
+    # a query ends when the next one starts or the cursor is closed
+    def _flush(self):
+        if self._elapsed is None:
+            return
+        if METRICS_ENABLED:
+            db_query_duration.observe(self._elapsed, self.name)
+        if SLOW_QUERY_LOG and self._elapsed >= slow_query_log.threshold:
+            query, params, many = self._statement
+            try:
+                rowcount = self._cursor.rowcount
+            except Exception:
+                rowcount = None
+            slow_query_log.record(self.name, query, params, rowcount, self._elapsed, many=many)
+        self._elapsed = None
+
+    def execute(self, query, params=(), *args, **kwargs):
+        self._flush()
+        self._statement = (query, params, False)
+        return self._timed(self._cursor.execute, query, params, *args, **kwargs)
+
+    def executemany(self, query, seq_params, *args, **kwargs):
+        self._flush()
+        self._statement = (query, seq_params, True)
+        return self._timed(self._cursor.executemany, query, seq_params, *args, **kwargs)
+
+    def fetchone(self):
+        return self._timed(self._cursor.fetchone)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._timed(self._cursor.fetchmany, *args, **kwargs)
+
+    def fetchall(self):
+        return self._timed(self._cursor.fetchall)
+
+    def close(self):
+        self._flush()
+        return self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def metered_cursor(cursor, name=None):
+    return MeteredCursor(cursor, name or "unnamed") if METRICS_ENABLED or SLOW_QUERY_LOG else cursor
+
+
+# pooled connection + cursor, both always returned/closed, also on error paths
+@contextmanager
+def db_cursor(dictionary=True, name=None):
+    with db_pool.connection() as conn:
+        cursor = metered_cursor(conn.cursor(dictionary=dictionary), name)
+        try:
+            yield conn, cursor
+        finally:
+            cursor.close()
+
+
+# blocking database calls run here, never on the event loop
+db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+
+class QueryTimeoutError(Exception):
+    pass
+
+
+async def run_in_db_executor(fn, *args, timeout=None):
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(db_executor, fn, *args)
+    try:
+        return await asyncio.wait_for(future, timeout or DB_QUERY_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise QueryTimeoutError(f"Query exceeded {timeout or DB_QUERY_TIMEOUT}s")
 
 
-# db connection
-def get_db_connection():
+# runs fn(conn, cursor) on a pooled connection in the db executor, name labels its query metrics
+async def run_db(fn, dictionary=True, timeout=None, name=None):
+    def work():
+        with db_cursor(dictionary=dictionary, name=name) as (conn, cursor):
+            return fn(conn, cursor)
+    return await run_in_db_executor(work, timeout=timeout)
+
+
+async def db_fetchall(query, params=(), dictionary=True, timeout=None, name=None):
+    def work(conn, cursor):
+        cursor.execute(query, params)
+        return cursor.fetchall()
+    return await run_db(work, dictionary=dictionary, timeout=timeout, name=name)
+
+
+async def db_fetchone(query, params=(), dictionary=True, timeout=None, name=None):
+    def work(conn, cursor):
+        cursor.execute(query, params)
+        row = cursor.fetchone()
+        cursor.fetchall()  # drain unread rows before the cursor is closed
+        return row
+    return await run_db(work, dictionary=dictionary, timeout=timeout, name=name)
+
+
+# executes a write and commits it, returns the affected row count
+async def db_execute(query, params=(), timeout=None, name=None):
+    def work(conn, cursor):
+        cursor.execute(query, params)
+        conn.commit()
+        return cursor.rowcount
+    return await run_db(work, timeout=timeout, name=name)
+
+
+@app.on_event("startup")
+async def open_db_pool():
     try:
-        conn = mysql.connector.connect(**db_config)
-        if conn.is_connected():
-            return conn
+        await run_in_db_executor(db_pool.fill)
     except mysql.connector.Error as e:
         logger.error(f"Error connecting to database: {e}")
-    return None
-    
+
+
+@app.on_event("shutdown")
+async def close_db_pool():
+    db_pool.close()
+    db_executor.shutdown(wait=False)
+
+
+# bounded LRU cache, entries expire at their own expires_at (epoch seconds) or after ttl,
+# max_bytes caps the summed size the callers report for their entries
+class LRUCache:
+    def __init__(self, maxsize, ttl=None, max_bytes=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._bytes = 0
+        self._data = OrderedDict()  # key -> (value, expires_at, size)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at, size = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._data[key]
+                self._bytes -= size
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, expires_at=None, size=0):
+        if expires_at is None and self.ttl is not None:
+            expires_at = time.time() + self.ttl
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (value, expires_at, size)
+            self._bytes += size
+            while len(self._data) > self.maxsize or (
+                self.max_bytes is not None and self._bytes > self.max_bytes and len(self._data) > 1
+            ):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            self._bytes -= entry[2]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+# concurrent calls with the same key share one execution; the first element of the key names the flight.
+# The load runs in its own task, a caller that disconnects does not cancel it for the others.
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+        self.leaders = defaultdict(int)
+        self.coalesced = defaultdict(int)
+
+    async def do(self, key, load):
+        if not SINGLE_FLIGHT_ENABLED:
+            return await load()
+        task = self._inflight.get(key)
+        if task is None:
+            self.leaders[key[0]] += 1
+            task = self._inflight[key] = asyncio.ensure_future(load())
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced[key[0]] += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            "in_flight": len(self._inflight),
+            "flights": {
+                name: {
+                    "queries": self.leaders[name],
+                    "coalesced": self.coalesced[name],
+                    "dedup_rate": round(self.coalesced[name] / (self.leaders[name] + self.coalesced[name]), 4),
+                }
+                for name in sorted(self.leaders)
+            },
+        }
+
+
+single_flight = SingleFlight()
 
 
 #class for signin
@@ -68,16 +1234,127 @@ class SignInRequest(BaseModel):
     email: str
     password: str
 
+@app.exception_handler(QueryTimeoutError)
+async def query_timeout_handler(request: Request, exc: QueryTimeoutError):
+    logger.error(f"Query timeout on {request.url.path}: {exc}")
+    return FastJSONResponse(
+        status_code=504,
+        content={"message": "Database query timed out"}
+    )
+
 #global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
     logger.error(f"Unhandled exception: {exc}")
-    return JSONResponse(
+    return FastJSONResponse(
         status_code=500,
         content={"message": "Internal server error"}
     )
 
+# bcrypt runs in worker processes, they only import passwords.py and not this module
+class PasswordHasher:
+    def __init__(self, workers, queue_limit):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.pending = 0
+        self._executor = None
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def _submit(self, fn, *args):
+        if self.pending >= self.queue_limit:
+            logger.warning("Password hashing queue full, rejecting request")
+            raise HTTPException(status_code=503, detail="Server busy, retry later", headers={"Retry-After": "1"})
+        self.start()
+        self.pending += 1
+        try:
+            for _ in range(2):
+                executor = self._executor
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+                except BrokenProcessPool:
+                    # a worker died (oom killer, segfault): the pool refuses all work until replaced
+                    logger.error("Password worker pool broken, restarting it")
+                    if self._executor is executor:
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        self._executor = None
+                        self.start()
+            raise HTTPException(status_code=503, detail="Server busy, retry later", headers={"Retry-After": "1"})
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password):
+        return await self._submit(hash_password, password)
+
+    async def verify_and_update(self, password, hashed):
+        return await self._submit(verify_password, password, hashed)
+
+
+password_hasher = PasswordHasher(PASSWORD_WORKERS, PASSWORD_QUEUE_LIMIT)
+
+
+@app.on_event("startup")
+async def start_password_hasher():
+    password_hasher.start()
+
+
+@app.on_event("shutdown")
+async def stop_password_hasher():
+    password_hasher.shutdown()
+
 # access token creation
+class SigningKeys:
+    def __init__(self, keys, active):
+        if active not in keys:
+            raise ValueError(f"Active signing key {active!r} is not among the configured keys")
+        self.keys = keys
+        self.active = active
+
+
+# first worker to start creates the keyfile, the others (and later restarts) read the same one
+def _create_keyfile(path):
+    kid = datetime.now().strftime("%Y%m%d%H%M%S")
+    tmp = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump({"active": kid, "keys": {kid: secrets.token_urlsafe(32)}}, f)
+    try:
+        os.link(tmp, path)  # atomic and exclusive: fails if another worker got there first
+        logger.info(f"Created signing keyfile {path}")
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp)
+
+
+def load_signing_keys():
+    if JWT_KEYFILE:
+        if not os.path.exists(JWT_KEYFILE):
+            _create_keyfile(JWT_KEYFILE)
+        with open(JWT_KEYFILE) as f:
+            config = json.load(f)
+        return SigningKeys(config["keys"], JWT_ACTIVE_KID or config["active"])
+    if JWT_KEYS:
+        keys = dict(pair.strip().split(":", 1) for pair in JWT_KEYS.split(",") if pair.strip())
+        return SigningKeys(keys, JWT_ACTIVE_KID or next(iter(keys)))
+    # nothing configured: per process key, tokens do not survive restarts nor work across workers
+    logger.warning("No JWT_KEYFILE or JWT_KEYS configured, using a random per-process signing key")
+    return SigningKeys({"local": secrets.token_urlsafe(32)}, "local")
+
+
+signing_keys = load_signing_keys()
+
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -85,30 +1362,59 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    keys = signing_keys
+    encoded_jwt = jwt.encode(to_encode, keys.keys[keys.active], algorithm=ALGORITHM, headers={"kid": keys.active})
     return encoded_jwt
 
-# token verifying
-async def verify_token(token: str = Depends(oauth2_scheme)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
+# verified claims by token hash, kept until the token's exp
+token_cache = LRUCache(TOKEN_CACHE_SIZE)
+
+
+def decode_token(token: str):
+    key = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(key)
+    if payload is None:
+        try:
+            # tokens without kid were issued before key rotation, checked against the active key
+            keys = signing_keys
+            secret = keys.keys.get(jwt.get_unverified_header(token).get("kid") or keys.active)
+            if secret is None:
+                raise HTTPException(status_code=401, detail="Invalid token")
+            payload = jwt.decode(token, secret, algorithms=[ALGORITHM])
+        except JWTError:
             raise HTTPException(status_code=401, detail="Invalid token")
-        return email
-    except JWTError as e:
-        raise HTTPException(status_code=401, detail="Invalid token")
+        if payload.get("sub") is None:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        token_cache.set(key, payload, expires_at=payload.get("exp"))
+    return payload
+
+
+# a retired kid must stop working at once, cached claims included
+def reload_signing_keys():
+    global signing_keys
+    # the random per-process key has nothing to reload, a new one would log everybody out
+    if not JWT_KEYFILE and not JWT_KEYS:
+        return
+    signing_keys = load_signing_keys()
+    token_cache.clear()
+
+
+# token verifying, shared auth dependency: returns the email in the token
+async def verify_token(token: str = Depends(oauth2_scheme)):
+    return decode_token(token)["sub"]
+
+
+# signup is open, so a user token alone never grants admin rights
+async def verify_admin(x_admin_token: str = Header(None), email: str = Depends(verify_token)):
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        logger.warning(f"Admin endpoint refused for {email}")
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return email
 
 #signup function
 @app.post("/api/v1/signup")
 async def signup(request: Request):
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        if not conn:
-            return JSONResponse(content={"error": "Could not connect to the database"}, status_code=500)
-
         data = await request.json()
         name = data.get("name")
         surname = data.get("surname")
@@ -116,23 +1422,20 @@ async def signup(request: Request):
         password = data.get("password")
 
         if not name or not surname or not email or not password:
-            return JSONResponse(content={"error": "Missing required fields"}, status_code=400)
+            return FastJSONResponse(content={"error": "Missing required fields"}, status_code=400)
 
-        cursor = conn.cursor(dictionary=True)
         #check if user already exist
         check_user_query = "SELECT * FROM cliente WHERE mail = %s"
-        cursor.execute(check_user_query, (email,))
-        existing_user = cursor.fetchone()
+        existing_user = await db_fetchone(check_user_query, (email,), name="user_by_mail")
 
         if existing_user:
-            return JSONResponse(content={"error": "User with this email already exists"}, status_code=405)
+            return FastJSONResponse(content={"error": "User with this email already exists"}, status_code=405)
 
-        hashed_password = pwd_context.hash(password)
+        hashed_password = await password_hasher.hash(password)
 
         #if not exist, insert new user
         insert_user_query = "INSERT INTO cliente (nome, cognome, mail, password) VALUES (%s, %s, %s, %s)"
-        cursor.execute(insert_user_query, (name, surname, email, hashed_password))
-        conn.commit()
+        await db_execute(insert_user_query, (name, surname, email, hashed_password), name="user_insert")
 
         # create JWT token
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -140,29 +1443,29 @@ async def signup(request: Request):
 
 
 
-        return JSONResponse(content={"access_token": access_token, "token_type": "bearer"}, status_code=201)
+        return FastJSONResponse(content={"access_token": access_token, "token_type": "bearer"}, status_code=201)
     except mysql.connector.Error as err:
-        return JSONResponse(content={"error": f"Error in retrieving data: {err}"}, status_code=500)
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        return FastJSONResponse(content={"error": f"Error in retrieving data: {err}"}, status_code=500)
 
 #login function
 @app.post("/api/v1/signin")
 async def signin(request: SignInRequest):
-    conn = None
-    cursor = None
     try:
-        conn = mysql.connector.connect(**db_config)
-        cursor = conn.cursor(dictionary=True)
         query = "SELECT password FROM cliente WHERE mail = %s"
-        cursor.execute(query, (request.email,))
-        user = cursor.fetchone()
+        user = await db_fetchone(query, (request.email,), name="user_password")
 
-        if not user or not pwd_context.verify(request.password, user['password']):
+        if not user:
             raise HTTPException(status_code=401, detail="Invalid email or password")
+        valid, new_hash = await password_hasher.verify_and_update(request.password, user['password'])
+        if not valid:
+            raise HTTPException(status_code=401, detail="Invalid email or password")
+
+        # cost factor changed since this hash was stored: upgrade it transparently
+        if new_hash:
+            try:
+                await db_execute("UPDATE cliente SET password = %s WHERE mail = %s", (new_hash, request.email), name="user_rehash")
+            except MySQLError as err:
+                logger.warning(f"Could not rehash password: {err}")
 
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(data={"sub": request.email}, expires_delta=access_token_expires)
@@ -171,11 +1474,6 @@ async def signin(request: SignInRequest):
     except mysql.connector.Error as db_err:
         logger.error(f"Database error: {db_err}")
         raise HTTPException(status_code=500, detail="Database error")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
 #post for token verification frontend
 @app.post("/api/v1/verify_token")
@@ -190,23 +1488,17 @@ async def verify_token_route(authorization: str = Header(None)):
     
     scheme, token = auth_parts
     
-    try:
-        if scheme.lower() != "bearer":
-            raise HTTPException(status_code=401, detail="Invalid authorization scheme")
-        
-        # Verifica la firma del token e ottieni il payload
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        # Se il token è valido, restituisci una risposta positiva
-        return {"valid": True}
-    except JWTError as e:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    if scheme.lower() != "bearer":
+        raise HTTPException(status_code=401, detail="Invalid authorization scheme")
+    
+    # Verifica la firma del token (o la trova in cache)
+    decode_token(token)
+    
+    # Se il token è valido, restituisci una risposta positiva
+    return {"valid": True}
 
-#base sql 
-baseSQL = """
+#restaurant read model: one precomputed row per locale, no fan-out over imgs/menu/piatto
+summarySQL = """
 SELECT 
     l.id AS id_locale,
     l.nome AS nome_locale,
@@ -223,58 +1515,593 @@ SELECT
     r.id AS id_regione,
     r.nome AS nome_regione,
     a.cf AS cf_admin,
-    a.password AS password_admin,
     a.nome AS nome_admin,
     a.cognome AS cognome_admin,
     a.email AS email_admin,
     az.piva AS piva_azienda,
     az.nome AS nome_azienda,
-    i.cf AS cf_imprenditore,
-    i.nome AS nome_imprenditore,
-    i.cognome AS cognome_imprenditore,
-    i.telefono AS telefono_imprenditore,
-    img.url AS img_url
+    az.cf_imprenditore AS cf_imprenditore,
+    (SELECT MIN(img.url) FROM imgs img WHERE img.id_locale = l.id) AS img_url,
+    (SELECT COUNT(*) FROM imgs img WHERE img.id_locale = l.id) AS img_count
 FROM locale l
 INNER JOIN comuni c ON c.id = l.id_comune  
 INNER JOIN province p ON p.id = c.id_provincia 
 INNER JOIN regioni r ON r.id = p.id_regione 
-INNER JOIN admin a ON a.id_locale = l.id 
 INNER JOIN azienda az ON az.piva = l.piva_azienda 
-INNER JOIN imprenditore i ON i.cf = az.cf_imprenditore
-INNER JOIN imgs img ON img.id_locale = l.id
-INNER JOIN menu m ON m.id_locale = l.id 
-INNER JOIN piatto pi ON pi.id_menu = m.id
-
+LEFT JOIN admin a ON a.cf = (SELECT MIN(adm.cf) FROM admin adm WHERE adm.id_locale = l.id)
 """
+
+#restaurant fields: columns of the read model, plus the imprenditore ones that need a join
+SUMMARY_FIELDS = (
+    "id_locale", "nome_locale", "via_locale", "civico_locale", "posti_max_locale", "descrizione_locale",
+    "banner_locale", "id_comune", "nome_comune", "id_provincia", "nome_provincia", "sigla_provincia",
+    "id_regione", "nome_regione", "cf_admin", "nome_admin", "cognome_admin", "email_admin",
+    "piva_azienda", "nome_azienda", "cf_imprenditore", "img_url", "img_count",
+)
+IMPRENDITORE_FIELDS = {
+    "nome_imprenditore": "i.nome",
+    "cognome_imprenditore": "i.cognome",
+    "telefono_imprenditore": "i.telefono",
+}
+RESTAURANT_FIELDS = SUMMARY_FIELDS + tuple(IMPRENDITORE_FIELDS)
+#default projection of list endpoints, what a restaurant card shows
+CARD_FIELDS = (
+    "id_locale", "nome_locale", "via_locale", "civico_locale", "banner_locale",
+    "nome_comune", "nome_provincia", "sigla_provincia", "nome_regione", "img_url",
+)
+
+
+# SELECT list for the requested fields, the imprenditore join only when one of its fields is asked
+def restaurantSQL(fields=RESTAURANT_FIELDS):
+    columns = [f"s.{field}" if field in SUMMARY_FIELDS else f"{IMPRENDITORE_FIELDS[field]} AS {field}" for field in fields]
+    query = "\nSELECT \n    " + ",\n    ".join(columns) + "\nFROM locale_summary s\n"
+    if any(field in IMPRENDITORE_FIELDS for field in fields):
+        query += "LEFT JOIN imprenditore i ON i.cf = s.cf_imprenditore\n"
+    return query
+
+
+#base sql, reads the read model
+baseSQL = restaurantSQL()
+
+
+# fields= query parameter: comma separated names, "all" for every field; id_locale is always included
+def parse_fields(fields, default):
+    if not fields:
+        return default
+    if fields.strip() == "all":
+        return RESTAURANT_FIELDS
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+    unknown = requested - set(RESTAURANT_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    requested.add("id_locale")
+    return tuple(field for field in RESTAURANT_FIELDS if field in requested)
+
+
+def project(row, fields):
+    if row is None or fields == RESTAURANT_FIELDS:
+        return row
+    return {field: row[field] for field in fields}
+
+
+async def create_restaurant_summary():
+    def work(conn, cursor):
+        db_backend.create_table_as(cursor, "locale_summary", summarySQL + " WHERE 1 = 0", ("id_locale",), [("id_comune",)])
+        conn.commit()
+    await run_db(work, name="summary_create")
+
+
+# rebuilds the read model rows of the given locale ids, or all of them when ids is None
+async def refresh_restaurant_summary(ids=None):
+    def work(conn, cursor):
+        if ids is None:
+            cursor.execute("DELETE FROM locale_summary")
+            cursor.execute("INSERT INTO locale_summary " + summarySQL)
+        else:
+            placeholders = ",".join(["%s"] * len(ids))
+            cursor.execute(f"DELETE FROM locale_summary WHERE id_locale IN ({placeholders})", tuple(ids))
+            cursor.execute(f"INSERT INTO locale_summary {summarySQL} WHERE l.id IN ({placeholders})", tuple(ids))
+        conn.commit()
+    await run_db(work, name="summary_refresh")
+
+
+#read-through cache for restaurant detail rows and the full listing
+restaurant_cache = LRUCache(RESTAURANT_CACHE_SIZE, ttl=RESTAURANT_CACHE_TTL, max_bytes=RESTAURANT_CACHE_MAX_BYTES)
+# bumped on every invalidation, a read that started before it must not fill the cache
+restaurant_cache_generation = 0
+
+
+def _payload_size(value):
+    return len(json_dumps(value))
+
+
+async def _cached_restaurant_read(key, load):
+    value = restaurant_cache.get(key)
+    if value is None:
+        generation = restaurant_cache_generation
+        # the generation is part of the flight key: a read started before an invalidation is never joined after it
+        value = await single_flight.do(("restaurant_" + key[0],) + key[1:] + (generation,), load)
+        if value and generation == restaurant_cache_generation:
+            restaurant_cache.set(key, value, size=_payload_size(value))
+    return value
+
+
+async def get_restaurant_row(id):
+    return await _cached_restaurant_read(
+        ("detail", str(id)),
+        lambda: db_fetchone(baseSQL + " WHERE s.id_locale = %s", (id,), name="restaurant_by_id"),
+    )
+
+
+async def get_restaurant_list():
+    return await _cached_restaurant_read(
+        ("all",),
+        lambda: db_fetchall(baseSQL + " ORDER BY s.id_locale", name="restaurant_list"),
+    )
+
+
+def invalidate_restaurant(id):
+    global restaurant_cache_generation
+    restaurant_cache_generation += 1
+    restaurant_cache.pop(("detail", str(id)))
+    restaurant_cache.pop(("all",))
+
+
+# to be called after any write to locale, imgs, admin or azienda rows of a restaurant
+async def restaurant_changed(id):
+    await refresh_restaurant_summary([id])
+    await apply_restaurant_change(id)
+    publish_change("restaurant", str(id))
+
+
+# drops the cached row and updates the in-memory indexes, also run for changes made by other workers
+async def apply_restaurant_change(id):
+    invalidate_restaurant(id)
+    row = await get_restaurant_row(id)
+    search_index.update(id, row)
+    if geo_index is not None:
+        geo_index.set_restaurant(id, row["id_comune"] if row else None)
+
+
+@app.on_event("startup")
+async def build_restaurant_summary():
+    try:
+        await create_restaurant_summary()
+        await refresh_restaurant_summary()
+    except MySQLError as e:
+        logger.error(f"Error building restaurant summary: {e}")
+
+# case and accent insensitive form used by the search index
+def normalize_text(value):
+    value = unicodedata.normalize("NFKD", str(value or ""))
+    return "".join(ch for ch in value if not unicodedata.combining(ch)).casefold().strip()
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+# in-memory trigram index over restaurant, comune, provincia and regione names
+class SearchIndex:
+    FIELDS = ("nome_locale", "nome_comune", "nome_provincia", "nome_regione")
+    # name matches weigh more than location matches when ranking
+    WEIGHTS = {"nome_locale": 4, "nome_comune": 3, "nome_provincia": 2, "nome_regione": 1}
+
+    def __init__(self):
+        self.ready = False
+        self._rows = {}  # id_locale -> row
+        self._texts = {}  # id_locale -> {field: normalized text}
+        self._keys = {}  # str(id_locale) -> id_locale, ids arrive as strings from query params
+        self._postings = {field: defaultdict(set) for field in self.FIELDS}
+
+    @classmethod
+    def build(cls, rows):
+        index = cls()
+        for row in rows:
+            index._add(row)
+        index.ready = True
+        return index
+
+    def _add(self, row):
+        id = row["id_locale"]
+        texts = {field: normalize_text(row.get(field)) for field in self.FIELDS}
+        self._rows[id] = row
+        self._texts[id] = texts
+        self._keys[str(id)] = id
+        for field, text in texts.items():
+            for gram in _trigrams(text):
+                self._postings[field][gram].add(id)
+
+    def _remove(self, id):
+        texts = self._texts.pop(id, None)
+        self._rows.pop(id, None)
+        self._keys.pop(str(id), None)
+        if texts is None:
+            return
+        for field, text in texts.items():
+            for gram in _trigrams(text):
+                ids = self._postings[field].get(gram)
+                if ids is not None:
+                    ids.discard(id)
+                    if not ids:
+                        del self._postings[field][gram]
+
+    def update(self, id, row):
+        key = self._keys.get(str(id))
+        if key is not None:
+            self._remove(key)
+        if row is not None:
+            self._add(row)
+
+    def _candidates(self, field, term):
+        grams = _trigrams(term)
+        if not grams:
+            # shorter than a trigram: verified by scanning
+            return set(self._rows)
+        postings = self._postings[field]
+        sets = sorted((postings.get(gram, set()) for gram in grams), key=len)
+        result = set(sets[0])
+        for ids in sets[1:]:
+            result &= ids
+            if not result:
+                break
+        return result
+
+    @staticmethod
+    def _score(text, term):
+        if text == term:
+            return 3
+        if text.startswith(term):
+            return 2
+        if f" {term}" in text:
+            return 1.5
+        return 1
+
+    # criteria: {field: term}, all must match as substrings; q: free text matched on any field
+    def search(self, criteria, q=None, limit=50):
+        criteria = {field: normalize_text(term) for field, term in criteria.items() if term}
+        q = normalize_text(q) if q else None
+        ids = None
+        for field, term in criteria.items():
+            matched = self._candidates(field, term)
+            ids = matched if ids is None else ids & matched
+        if q:
+            any_field = set()
+            for field in self.FIELDS:
+                any_field |= self._candidates(field, q)
+            ids = any_field if ids is None else ids & any_field
+        if ids is None:
+            ids = set(self._rows)
+
+        ranked = []
+        for id in ids:
+            texts = self._texts[id]
+            score = 0
+            for field, term in criteria.items():
+                if term not in texts[field]:
+                    break
+                score += self.WEIGHTS[field] * self._score(texts[field], term)
+            else:
+                if q:
+                    q_scores = [self.WEIGHTS[field] * self._score(texts[field], q) for field in self.FIELDS if q in texts[field]]
+                    if not q_scores:
+                        continue
+                    score += max(q_scores)
+                ranked.append((-score, texts["nome_locale"], id))
+        ranked.sort(key=lambda item: (item[0], item[1], str(item[2])))
+        return [self._rows[id] for _, _, id in ranked[:limit]]
+
+
+search_index = SearchIndex()
+
+
+@app.on_event("startup")
+async def build_search_index():
+    global search_index
+    try:
+        search_index = SearchIndex.build(await get_restaurant_list() or [])
+    except MySQLError as e:
+        logger.error(f"Error building search index: {e}")
+
+#reference tables, they change a few times a year: loaded once into immutable snapshots
+referenceSQL = {
+    "turns": "SELECT id, TIME_FORMAT(ora_inizio, '%H:%i:%s') AS ora_inizio, TIME_FORMAT(ora_fine, '%H:%i:%s') AS ora_fine FROM turno ORDER BY id",
+    "regioni": "SELECT id, nome FROM regioni ORDER BY id",
+    "province": "SELECT id, nome, sigla, id_regione FROM province ORDER BY id",
+    "comuni": "SELECT id, nome, id_provincia FROM comuni ORDER BY id",
+}
+
+
+# rows plus their serialized body and a strong ETag, computed once per load
+class ReferenceSnapshot:
+    def __init__(self, rows):
+        self.rows = tuple(MappingProxyType(dict(row)) for row in rows)
+        self.body = json_dumps([dict(row) for row in self.rows])
+        self.etag = '"' + hashlib.sha256(self.body).hexdigest() + '"'
+
+    def as_list(self):
+        return [dict(row) for row in self.rows]
+
+
+reference_data = {}
+
+
+async def load_reference_data():
+    snapshots = {}
+    for name, query in referenceSQL.items():
+        snapshots[name] = ReferenceSnapshot(await db_fetchall(query, name=f"reference_{name}"))
+    # swapped in one assignment, readers never see a half loaded set
+    reference_data.clear()
+    reference_data.update(snapshots)
+
+
+async def get_reference(name):
+    if name not in reference_data:
+        await load_reference_data()
+    return reference_data[name]
+
+
+def snapshot_response(request, snapshot):
+    headers = {"ETag": snapshot.etag, "Cache-Control": f"private, max-age={REFERENCE_MAX_AGE}"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or snapshot.etag in [tag.strip() for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot.body, media_type="application/json", headers=headers)
+
+
+@app.on_event("startup")
+async def build_reference_data():
+    try:
+        await load_reference_data()
+    except MySQLError as e:
+        logger.error(f"Error loading reference data: {e}")
+
+
+#reference tables: turns, regioni, province, comuni
+@app.get("/api/v1/reference/{name}")
+async def get_reference_table(name: str, request: Request, token: str = Depends(verify_token)):
+    if name not in referenceSQL:
+        return FastJSONResponse(content={"error": f"Unknown reference table: {name}"}, status_code=404)
+    try:
+        return snapshot_response(request, await get_reference(name))
+    except MySQLError as err:
+        logger.error(f"Error retrieving data: {err}")
+        return FastJSONResponse(content={"error": f"Error retrieving data: {err}"}, status_code=500)
+
+
+#reloads reference snapshots and the indexes derived from them, drops cached menus;
+#also the way to publish restaurants, images, admins or companies written outside the api
+@app.post("/api/v1/admin/reload")
+async def reload_reference_data(token: str = Depends(verify_admin)):
+    try:
+        # locale_summary is shared, rebuilt once here and not by the workers applying the event
+        await refresh_restaurant_summary()
+        await apply_reload()
+    except MySQLError as err:
+        logger.error(f"Error reloading reference data: {err}")
+        return FastJSONResponse(content={"error": f"Error reloading reference data: {err}"}, status_code=500)
+    publish_change("reload")
+    logger.info(f"Reference data reloaded by {token}")
+    return FastJSONResponse(content={name: {"rows": len(snapshot.rows), "etag": snapshot.etag} for name, snapshot in reference_data.items()})
+
+async def apply_reload():
+    global menu_cache_generation, restaurant_cache_generation
+    await load_reference_data()
+    restaurant_cache_generation += 1
+    restaurant_cache.clear()
+    await load_geo_index()
+    await build_search_index()
+    menu_cache_generation += 1
+    menu_cache.clear()
+    reload_signing_keys()
+
+
+#slow query shapes by total time, with their EXPLAIN, and the most recent slow statements
+@app.get("/api/v1/admin/slow_queries")
+async def get_slow_queries(clear: bool = Query(False), token: str = Depends(verify_admin)):
+    result = slow_query_log.snapshot()
+    if clear:
+        slow_query_log.clear()
+        logger.info(f"Slow query log cleared by {token}")
+    return FastJSONResponse(content=result)
+
+# in-memory regione -> provincia -> comune hierarchy, with the restaurants of every comune
+class GeoIndex:
+    def __init__(self, regioni, province, comuni, restaurants):
+        self.regioni_by_name = defaultdict(set)
+        self.province_by_name = defaultdict(set)
+        self.comuni_by_name = defaultdict(set)
+        self.province_in_regione = defaultdict(set)
+        self.comuni_in_provincia = defaultdict(set)
+        self.restaurants_in_comune = defaultdict(set)
+        self.restaurant_comune = {}  # str(id_locale) -> (id_locale, id_comune)
+        for row in regioni:
+            self.regioni_by_name[normalize_text(row["nome"])].add(row["id"])
+        for row in province:
+            self.province_by_name[normalize_text(row["nome"])].add(row["id"])
+            self.province_in_regione[row["id_regione"]].add(row["id"])
+        for row in comuni:
+            self.comuni_by_name[normalize_text(row["nome"])].add(row["id"])
+            self.comuni_in_provincia[row["id_provincia"]].add(row["id"])
+        for row in restaurants:
+            self.set_restaurant(row["id_locale"], row["id_comune"])
+
+    def set_restaurant(self, id, id_comune):
+        previous = self.restaurant_comune.pop(str(id), None)
+        if previous is not None:
+            self.restaurants_in_comune[previous[1]].discard(previous[0])
+        if id_comune is not None:
+            id = int(id) if isinstance(id, str) and id.isdigit() else id
+            self.restaurant_comune[str(id)] = (id, id_comune)
+            self.restaurants_in_comune[id_comune].add(id)
+
+    def _comuni_of_province(self, province):
+        return {c for p in province for c in self.comuni_in_provincia[p]}
+
+    # comuni matching every given name, None when no name is given
+    def comuni(self, village=None, county=None, state=None):
+        result = None
+        if village:
+            result = set(self.comuni_by_name.get(normalize_text(village), ()))
+        if county:
+            matched = self._comuni_of_province(self.province_by_name.get(normalize_text(county), ()))
+            result = matched if result is None else result & matched
+        if state:
+            province = {p for r in self.regioni_by_name.get(normalize_text(state), ()) for p in self.province_in_regione[r]}
+            matched = self._comuni_of_province(province)
+            result = matched if result is None else result & matched
+        return result
+
+    # comuni in the province named county or named village
+    def comuni_near(self, village=None, county=None):
+        result = set()
+        if county:
+            result |= self._comuni_of_province(self.province_by_name.get(normalize_text(county), ()))
+        if village:
+            result |= self.comuni_by_name.get(normalize_text(village), set())
+        return result
+
+    def restaurants(self, comuni):
+        return {id for c in comuni for id in self.restaurants_in_comune.get(c, ())}
+
+
+geo_index = None
+
+
+async def load_geo_index():
+    global geo_index
+    regioni = (await get_reference("regioni")).rows
+    province = (await get_reference("province")).rows
+    comuni = (await get_reference("comuni")).rows
+    restaurants = await db_fetchall("SELECT id_locale, id_comune FROM locale_summary", name="geo_restaurants")
+    geo_index = GeoIndex(regioni, province, comuni, restaurants)
+    return geo_index
+
+
+async def get_geo_index():
+    return geo_index or await load_geo_index()
+
+
+@app.on_event("startup")
+async def build_geo_index():
+    try:
+        await load_geo_index()
+    except MySQLError as e:
+        logger.error(f"Error building geographic index: {e}")
+
+
+def _chunks(values, size):
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+
+# IN (...) lookups are split in chunks of RESTAURANT_BATCH_CHUNK ids
+async def fetch_restaurants(ids, fields=RESTAURANT_FIELDS):
+    rows = []
+    query = restaurantSQL(fields)
+    for chunk in _chunks(sorted(ids), RESTAURANT_BATCH_CHUNK):
+        placeholders = ",".join(["%s"] * len(chunk))
+        rows += await db_fetchall(query + f" WHERE s.id_locale IN ({placeholders}) ORDER BY s.id_locale", tuple(chunk), name="restaurant_by_ids")
+    return rows
+
+
+async def fetch_imgs(ids):
+    imgs = defaultdict(list)
+    for chunk in _chunks(sorted(ids), RESTAURANT_BATCH_CHUNK):
+        placeholders = ",".join(["%s"] * len(chunk))
+        for row in await db_fetchall(f"SELECT * FROM imgs WHERE id_locale IN ({placeholders})", tuple(chunk), name="imgs_by_ids"):
+            imgs[str(row["id_locale"])].append(row)
+    return imgs
+
+
+# detail rows of many restaurants, cached ones from restaurant_cache, the rest in chunked IN queries
+async def get_restaurant_rows(ids):
+    ids = list(dict.fromkeys(str(id) for id in ids))
+    rows = {}
+    missing = []
+    for id in ids:
+        row = restaurant_cache.get(("detail", id))
+        if row is None:
+            missing.append(id)
+        else:
+            rows[id] = row
+    if missing:
+        generation = restaurant_cache_generation
+        # identical batches in flight share one query, keyed like _cached_restaurant_read
+        key = ("restaurant_batch",) + tuple(sorted(missing)) + (generation,)
+        for row in await single_flight.do(key, lambda: fetch_restaurants(missing)):
+            id = str(row["id_locale"])
+            rows[id] = row
+            if generation == restaurant_cache_generation:
+                restaurant_cache.set(("detail", id), row, size=_payload_size(row))
+    return rows
+
+
+async def fetch_restaurants_near(village, county, exclude, fields=RESTAURANT_FIELDS):
+    index = await get_geo_index()
+    excluded = {str(id) for id in exclude or []}
+    ids = [id for id in index.restaurants(index.comuni_near(village, county)) if str(id) not in excluded]
+    return await fetch_restaurants(ids, fields)
+
+# writes the catalog as NDJSON straight from an unbuffered cursor, in constant memory
+def stream_restaurants(after=None, fields=RESTAURANT_FIELDS):
+    # a full scan can outlast DB_QUERY_TIMEOUT, rows are flushed to the client as they come
+    query = restaurantSQL(fields).replace("SELECT", db_backend.streamSelect, 1)
+    params = ()
+    if after is not None:
+        query += " WHERE s.id_locale > %s"
+        params = (after,)
+    query += " ORDER BY s.id_locale"
+    with db_pool.connection() as conn:
+        cursor = metered_cursor(conn.cursor(dictionary=True), "restaurant_stream")
+        try:
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(RESTAURANT_STREAM_BATCH)
+                if not rows:
+                    break
+                yield b"".join(json_dumps(row) + b"\n" for row in rows)
+        finally:
+            try:
+                cursor.close()
+            except MySQLError:
+                # client went away mid-stream, the unread rows make the pool discard this connection
+                pass
+
 #get all restaurants in db
 @app.get("/api/v1/restaurant/all")
-async def get_all_restaurants(request: Request, token: str = Depends(verify_token)):
+async def get_all_restaurants(
+    request: Request,
+    limit: int | None = Query(None, ge=1, le=RESTAURANT_PAGE_MAX),
+    after: int | None = Query(None),
+    stream: bool = Query(False),
+    fields: str = Query(None),
+    token: str = Depends(verify_token)
+):
     logger.info("Attempting to retrieve all restaurants...")
-    conn = None
-    cursor = None
+    fields = parse_fields(fields, CARD_FIELDS)
+    if stream:
+        return StreamingResponse(stream_restaurants(after, fields), media_type="application/x-ndjson")
     try:
-        conn = get_db_connection()
-        if not conn:
-            logger.error("Database connection failed")
-            raise HTTPException(status_code=500, detail="Database connection failed")
-        
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(baseSQL + "GROUP BY l.id")
-        results = cursor.fetchall()
+        # keyset pagination on id_locale, the next cursor is returned in X-Next-After
+        if limit is not None or after is not None:
+            limit = limit or RESTAURANT_PAGE_SIZE
+            query = restaurantSQL(fields) + " WHERE s.id_locale > %s ORDER BY s.id_locale LIMIT %s"
+            results = await db_fetchall(query, (after if after is not None else -1, limit), name="restaurant_page")
+            headers = {}
+            if len(results) == limit:
+                headers["X-Next-After"] = str(results[-1]["id_locale"])
+            return FastJSONResponse(content=results, status_code=200, headers=headers)
+
+        results = await get_restaurant_list()
         
         if not results:
             logger.info("No restaurants found")
-            return JSONResponse(content={"message": "No restaurants found"}, status_code=200)
+            return FastJSONResponse(content={"message": "No restaurants found"}, status_code=200)
         
-        return JSONResponse(content=results, status_code=200)
+        return FastJSONResponse(content=[project(row, fields) for row in results], status_code=200)
     except mysql.connector.Error as err:
         logger.error(f"Database error: {err}")
         raise HTTPException(status_code=500, detail="Database error")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
 #search restaurants
 @app.get("/search_restaurants")
@@ -283,107 +2110,150 @@ async def search_restaurants(
     nome_comune: str = Query(None), 
     nome_provincia: str = Query(None), 
     nome_regione: str = Query(None), 
+    q: str = Query(None),
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=SEARCH_LIMIT_MAX),
+    fields: str = Query(None),
     token: str = Depends(verify_token)
 ):
-    logger.info(f"Searching restaurants with criteria - locale: {nome_locale}, comune: {nome_comune}, provincia: {nome_provincia}, regione: {nome_regione}")
-    conn = None
-    cursor = None
-    try:
-        conn = get_db_connection()
-        if not conn:
-            logger.error("Database connection failed")
-            raise HTTPException(status_code=500, detail="Database connection failed")
-        
-        cursor = conn.cursor(dictionary=True)
-        query = baseSQL + " WHERE 1=1"
+    logger.info(f"Searching restaurants with criteria - locale: {nome_locale}, comune: {nome_comune}, provincia: {nome_provincia}, regione: {nome_regione}, q: {q}")
+    fields = parse_fields(fields, CARD_FIELDS)
+    if search_index.ready:
+        results = search_index.search({
+            "nome_locale": nome_locale,
+            "nome_comune": nome_comune,
+            "nome_provincia": nome_provincia,
+            "nome_regione": nome_regione,
+        }, q=q, limit=limit)
+        if not results:
+            logger.info("No restaurants found with given criteria")
+            return FastJSONResponse(content={"message": "No restaurants found with given criteria"}, status_code=200)
+        return FastJSONResponse(content=[project(row, fields) for row in results], status_code=200)
+
+    # index not built (database down at startup): plain LIKE search
+    try:
+        query = restaurantSQL(fields) + " WHERE 1=1"
         params = []
         
         if nome_locale:
-            query += " AND l.nome LIKE %s"
+            query += " AND s.nome_locale LIKE %s"
             params.append(f"%{nome_locale}%")
         if nome_comune:
-            query += " AND c.nome LIKE %s"
+            query += " AND s.nome_comune LIKE %s"
             params.append(f"%{nome_comune}%")
         if nome_provincia:
-            query += " AND p.nome LIKE %s"
+            query += " AND s.nome_provincia LIKE %s"
             params.append(f"%{nome_provincia}%")
         if nome_regione:
-            query += " AND r.nome LIKE %s"
+            query += " AND s.nome_regione LIKE %s"
             params.append(f"%{nome_regione}%")
+        if q:
+            query += " AND (s.nome_locale LIKE %s OR s.nome_comune LIKE %s OR s.nome_provincia LIKE %s OR s.nome_regione LIKE %s)"
+            params.extend([f"%{q}%"] * 4)
         
-        query += "GROUP BY locale.id"
-        cursor.execute(query, tuple(params))
-        results = cursor.fetchall()
+        query += " ORDER BY s.id_locale LIMIT %s"
+        params.append(limit)
+        results = await db_fetchall(query, tuple(params), name="restaurant_search")
         
         if not results:
             logger.info("No restaurants found with given criteria")
-            return JSONResponse(content={"message": "No restaurants found with given criteria"}, status_code=200)
+            return FastJSONResponse(content={"message": "No restaurants found with given criteria"}, status_code=200)
         
-        return JSONResponse(content= results, status_code=200)
+        return FastJSONResponse(content= results, status_code=200)
     except mysql.connector.Error as err:
         logger.error(f"Database error: {err}")
         raise HTTPException(status_code=500, detail="Database error")
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
 
 #get a restaurant from id 
 @app.post("/api/v1/get_restaurant_from_id")
 
-async def get_restaurant_from_id(request: Request, token: str = Depends(verify_token)):
-    conn = get_db_connection()
-    if not conn:
-        return JSONResponse(content={"error": "Could not connect to the database"}, status_code=500)
-
+async def get_restaurant_from_id(request: Request, fields: str = Query(None), token: str = Depends(verify_token)):
+    fields = parse_fields(fields, RESTAURANT_FIELDS)
     try:
         data = await request.json()
         id = data.get("id")
         if not id:
-            return JSONResponse(content={"error": "Missing parameter: id"}, status_code=400)
+            return FastJSONResponse(content={"error": "Missing parameter: id"}, status_code=400)
 
-        cursor = conn.cursor(dictionary=True)
-        query = baseSQL + " WHERE l.id = %s GROUP BY l.id"
-        cursor.execute(query, (id,))
-        result = cursor.fetchone()
+        result = project(await get_restaurant_row(id), fields)
         if result:
-            return JSONResponse(content=result)
+            return FastJSONResponse(content=result)
         else:
-            return JSONResponse(content={"message": "No data found"}, status_code=404)
-    except Error as err:
+            return FastJSONResponse(content={"message": "No data found"}, status_code=404)
+    except MySQLError as err:
         logger.error(f"Error retrieving data: {err}")
-        return JSONResponse(content={"error": f"Errore nel recupero dei dati: {err}"}, status_code=500)
-    finally:
-        cursor.close()
-        conn.close()
+        return FastJSONResponse(content={"error": f"Errore nel recupero dei dati: {err}"}, status_code=500)
 
 #test function
 @app.get("/ping")
 async def ping():
-    return JSONResponse(content="pong")
-
-#get all turns function
+    return FastJSONResponse(content="pong")
+
+#cache and pool statistics for monitoring
+@app.get("/api/v1/stats")
+async def get_stats(token: str = Depends(verify_token)):
+    return FastJSONResponse(content={
+        "db_pool": db_pool.stats(),
+        "token_cache": token_cache.stats(),
+        "restaurant_cache": restaurant_cache.stats(),
+        "seat_counters": seat_counters.stats(),
+        "reservation_batches": reservation_batcher.stats(),
+        "menu_cache": menu_cache.stats(),
+        "shared_state": shared_events.stats() if shared_events is not None else None,
+        "admission": admission.stats(),
+        "single_flight": single_flight.stats(),
+    })
+
+
+# cache and pool state, read at scrape time
+def collect_state_metrics():
+    hits = Counter("cache_hits_total", "Cache hits", ("cache",))
+    misses = Counter("cache_misses_total", "Cache misses", ("cache",))
+    hit_ratio = Gauge("cache_hit_ratio", "Cache hits over lookups since start", ("cache",))
+    entries = Gauge("cache_entries", "Entries held by the cache", ("cache",))
+    for name, cache in (("token", token_cache), ("restaurant", restaurant_cache), ("menu", menu_cache)):
+        stats = cache.stats()
+        hits.inc(name, amount=stats["hits"])
+        misses.inc(name, amount=stats["misses"])
+        hit_ratio.inc(name, amount=stats["hit_rate"])
+        entries.inc(name, amount=stats["size"])
+    connections = Gauge("db_pool_connections", "Pooled connections by state", ("state",))
+    for state, value in db_pool.stats().items():
+        if state in ("size", "idle", "in_use"):
+            connections.inc(state, amount=value)
+    queue_depth = Gauge("admission_queue_depth", "Requests waiting for admission", ("class",))
+    admission_active = Gauge("admission_active", "Requests admitted and running", ("class",))
+    rejected = Counter("admission_rejected_total", "Requests answered 503 by admission control", ("class", "reason"))
+    for name, cls in admission.classes.items():
+        queue_depth.inc(name, amount=len(cls.waiting))
+        admission_active.inc(name, amount=cls.active)
+        rejected.inc(name, "queue_full", amount=cls.shed)
+        rejected.inc(name, "deadline", amount=cls.expired)
+    flights = Counter("singleflight_calls_total", "Coalescable reads by flight, leaders ran the query", ("flight", "role"))
+    for name in list(single_flight.leaders):
+        flights.inc(name, "leader", amount=single_flight.leaders[name])
+        flights.inc(name, "coalesced", amount=single_flight.coalesced[name])
+    return [hits, misses, hit_ratio, entries, connections, queue_depth, admission_active, rejected, flights]
+
+
+metrics.collectors.append(collect_state_metrics)
+
+
+#Prometheus scrape endpoint, no token like /ping
+@app.get("/metrics")
+async def get_metrics():
+    if not METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return Response(content=metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+#get all turns function, served from the reference snapshot
 @app.get("/api/v1/turns")
 async def get_all_turns(request: Request, token: str = Depends(verify_token)):
-
-    conn = get_db_connection()
-    if not conn:
-        return JSONResponse(content={"error": "Could not connect to the database"}, status_code=500)
-
     try:
-        cursor = conn.cursor(dictionary=True)
-        query = "SELECT id, TIME_FORMAT(ora_inizio, '%H:%i:%s') AS ora_inizio, TIME_FORMAT(ora_fine, '%H:%i:%s') AS ora_fine FROM turno"
-        cursor.execute(query)
-        result = cursor.fetchall()
-        return JSONResponse(content=result)
-    except Error as err:
+        return snapshot_response(request, await get_reference("turns"))
+    except MySQLError as err:
         logger.error(f"Error retrieving data: {err}")
-        return JSONResponse(content={"error": f"Errore nel recupero dei dati: {err}"}, status_code=500)
-    finally:
-        cursor.close()
-        conn.close()
+        return FastJSONResponse(content={"error": f"Errore nel recupero dei dati: {err}"}, status_code=500)
 
 
 # class for available tables in restaurant
@@ -392,59 +2262,422 @@ class TableCheckRequest(BaseModel):
     turn: int
     id: int
     
+def _normalize_date(date):
+    try:
+        return datetime.strptime(str(date)[:10], "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        return str(date)
+
+
+# date and turn of a slot request, checked before they become seat counter keys
+async def slot_error(date, turn):
+    try:
+        datetime.strptime(str(date), "%Y-%m-%d")
+    except ValueError:
+        return "date must be in YYYY-MM-DD format"
+    turns = await get_reference("turns")
+    if str(turn) not in {str(row["id"]) for row in turns.rows}:
+        return "turn must be the id of one of the turns"
+    return None
+
+
+def _slot_key(id, date, turn):
+    return (str(id), _normalize_date(date), str(turn))
+
+
+# reserved seats per (locale, data, turno): hydrated from prenota on first access,
+# incremented when a reservation commits and periodically reconciled with the database
+class SeatCounters:
+    def __init__(self, max_slots):
+        self.max_slots = max_slots
+        self._reserved = OrderedDict()  # least recently used first
+        # last add per slot, a database read started before an add must not overwrite it
+        self._versions = {}
+        self._sequence = 0
+        # bumped when versions are dropped, reads in flight across it are discarded
+        self._epoch = 0
+        self.hydrations = 0
+        self.reconciliations = 0
+        self.evictions = 0
+
+    def _version(self, key):
+        return self._epoch, self._versions.get(key)
+
+    def _bump(self, key):
+        self._sequence += 1
+        self._versions[key] = self._sequence
+        if len(self._versions) > 2 * self.max_slots:
+            self._versions = {key: version for key, version in self._versions.items() if key in self._reserved}
+            self._epoch += 1
+
+    def _store(self, key, seats):
+        self._reserved[key] = seats
+        self._reserved.move_to_end(key)
+        while len(self._reserved) > self.max_slots:
+            self._reserved.popitem(last=False)
+            self.evictions += 1
+
+    async def reserved(self, id, date, turn):
+        key = _slot_key(id, date, turn)
+        if key in self._reserved:
+            self._reserved.move_to_end(key)
+            return self._reserved[key]
+        version = self._version(key)
+        row = await db_fetchone(
+            "SELECT COALESCE(SUM(num_posti), 0) FROM prenota WHERE id_locale = %s AND data = %s AND id_turno = %s",
+            key, dictionary=False, name="availability_slot",
+        )
+        seats = int(row[0])
+        # a booking landed during the read: the value is answered but not cached, the next read retries
+        if version == self._version(key) and key not in self._reserved:
+            self._store(key, seats)
+            self.hydrations += 1
+        return seats
+
+    def add(self, id, date, turn, seats):
+        key = _slot_key(id, date, turn)
+        self._bump(key)
+        if key in self._reserved:
+            self._reserved[key] += int(seats)
+        publish_change("seats", json.dumps(key))
+
+    # slot booked by another worker: reloaded from the database on next access
+    def invalidate(self, key):
+        self._bump(key)
+        self._reserved.pop(key, None)
+
+    def clear(self):
+        for key in list(self._reserved):
+            self.invalidate(key)
+
+    async def reconcile(self, chunk_size=200):
+        today = datetime.now().date().isoformat()
+        for key in [key for key in self._reserved if key[1] < today]:
+            self._reserved.pop(key, None)
+        keys = list(self._reserved)
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            versions = {key: self._version(key) for key in chunk}
+            placeholders = ",".join(["(%s, %s, %s)"] * len(chunk))
+            rows = await db_fetchall(
+                "SELECT id_locale, data, id_turno, SUM(num_posti) FROM prenota "
+                f"WHERE (id_locale, data, id_turno) IN ({placeholders}) GROUP BY id_locale, data, id_turno",
+                tuple(value for key in chunk for value in key), dictionary=False, name="availability_reconcile",
+            )
+            totals = {_slot_key(*row[:3]): int(row[3]) for row in rows}
+            for key in chunk:
+                if key in self._reserved and versions[key] == self._version(key):
+                    self._reserved[key] = totals.get(key, 0)
+        self.reconciliations += 1
+
+    # reserved seats for every (date, turn) of a restaurant, missing slots loaded with one grouped query
+    async def reserved_range(self, id, dates, turns):
+        keys = [_slot_key(id, date, turn) for date in dates for turn in turns]
+        seats = {key: self._reserved[key] for key in keys if key in self._reserved}
+        for key in seats:
+            self._reserved.move_to_end(key)
+        missing = [key for key in keys if key not in seats]
+        if missing:
+            versions = {key: self._version(key) for key in missing}
+            rows = await db_fetchall(
+                "SELECT data, id_turno, SUM(num_posti) FROM prenota "
+                "WHERE id_locale = %s AND data BETWEEN %s AND %s GROUP BY data, id_turno",
+                (id, dates[0], dates[-1]), dictionary=False, name="availability_range",
+            )
+            totals = {_slot_key(id, row[0], row[1]): int(row[2]) for row in rows}
+            for key in missing:
+                seats[key] = totals.get(key, 0)
+                # slots raced by a booking are answered with the value read, without caching it
+                if key not in self._reserved and versions[key] == self._version(key):
+                    self._store(key, seats[key])
+                    self.hydrations += 1
+        return [seats[key] for key in keys]
+
+    def stats(self):
+        return {
+            "slots": len(self._reserved),
+            "max_slots": self.max_slots,
+            "evictions": self.evictions,
+            "hydrations": self.hydrations,
+            "reconciliations": self.reconciliations,
+        }
+
+
+seat_counters = SeatCounters(SEAT_COUNTERS_MAX_SLOTS)
+
+
+async def reconcile_seat_counters_forever():
+    while True:
+        await asyncio.sleep(SEAT_COUNTERS_RECONCILE_SECONDS)
+        try:
+            await seat_counters.reconcile()
+        except (MySQLError, QueryTimeoutError) as e:
+            logger.error(f"Error reconciling seat counters: {e}")
+
+
+@app.on_event("startup")
+async def start_seat_counters_reconciliation():
+    app.state.seat_counters_task = asyncio.create_task(reconcile_seat_counters_forever())
+
+
+@app.on_event("shutdown")
+async def stop_seat_counters_reconciliation():
+    app.state.seat_counters_task.cancel()
+
 # tables availability function
 @app.get("/api/v1/tables")
 async def check_tables(date: str, turn: str | int, id: str | int,token: str = Depends(verify_token)):
     try:
-        conn = get_db_connection()
-        if not conn:
-            return JSONResponse(content={"error": "Could not connect to the database"}, status_code=500)
-        cursor = conn.cursor()
-
-        query = """
-        SELECT 
-            SUM(prenota.num_posti) AS total_reserved,
-            locale.posti_max AS max
-        FROM 
-            locale 
-        LEFT JOIN 
-            prenota ON prenota.id_locale = locale.id AND prenota.data = %s AND prenota.id_turno = %s
-        WHERE 
-            locale.id = %s
-        GROUP BY 
-            locale.posti_max
-        """
-
-        cursor.execute(query, (date,turn,id))
-        result = cursor.fetchone()
-
-        if not result:
-            # Se non ci sono prenotazioni per questo locale, restituisci solo il numero massimo di posti
-            max_seats_query = """
-            SELECT posti_max FROM locale WHERE id = %s
-            """
-            cursor.execute(max_seats_query, (data.id,))
-            max_seats_result = cursor.fetchone()
-            if max_seats_result:
-                return JSONResponse(content={"available_seats": max_seats_result[0]}, status_code=200)
-            else:
-                return JSONResponse(content={"message": "No results found"}, status_code=200)
-
-        # Calcola i posti disponibili
-        total_reserved = result[0] or 0  # Se total_reserved è None, assegna 0
-        max_seats = result[1] or 0  # Se max_seats è None, assegna 0
+        error = await slot_error(date, turn)
+        if error:
+            return FastJSONResponse(content={"error": error}, status_code=400)
+        restaurant = await get_restaurant_row(id)
+        if not restaurant:
+            return FastJSONResponse(content={"message": "No results found"}, status_code=200)
+
+        # Calcola i posti disponibili, dai contatori in memoria
+        total_reserved = await seat_counters.reserved(id, date, turn)
+        max_seats = restaurant["posti_max_locale"] or 0  # Se max_seats è None, assegna 0
         available_seats = max_seats - total_reserved
 
-        return JSONResponse(content={"available_seats": available_seats}, status_code=200)
+        return FastJSONResponse(content={"available_seats": available_seats}, status_code=200)
 
     except MySQLError as err:
         logging.error(f"Error retrieving data: {err}")
-        return JSONResponse(content={"error": f"Error retrieving data: {err}"}, status_code=500)
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        return FastJSONResponse(content={"error": f"Error retrieving data: {err}"}, status_code=500)
+
+
+# availability matrix of a restaurant: one row per date, one column per turn
+@app.get("/api/v1/tables/calendar")
+async def get_tables_calendar(
+    id: str | int,
+    start: str = Query(None),
+    end: str = Query(None),
+    token: str = Depends(verify_token)
+):
+    try:
+        start_date = datetime.strptime(start, "%Y-%m-%d").date() if start else datetime.now().date()
+        end_date = datetime.strptime(end, "%Y-%m-%d").date() if end else start_date + timedelta(days=6)
+    except ValueError:
+        return FastJSONResponse(content={"error": "Dates must be in YYYY-MM-DD format"}, status_code=400)
+    days = (end_date - start_date).days + 1
+    if days < 1 or days > CALENDAR_MAX_DAYS:
+        return FastJSONResponse(content={"error": f"Date range must span 1 to {CALENDAR_MAX_DAYS} days"}, status_code=400)
+
+    try:
+        restaurant = await get_restaurant_row(id)
+        if not restaurant:
+            return FastJSONResponse(content={"message": "No results found"}, status_code=200)
+        turns = (await get_reference("turns")).as_list()
+        dates = [(start_date + timedelta(days=i)).isoformat() for i in range(days)]
+        turn_ids = [turn["id"] for turn in turns]
+
+        reserved = await seat_counters.reserved_range(id, dates, turn_ids)
+        max_seats = restaurant["posti_max_locale"] or 0
+        available = [max_seats - seats for seats in reserved]
+        width = len(turn_ids)
+        return FastJSONResponse(content={
+            "id": restaurant["id_locale"],
+            "max_seats": max_seats,
+            "turns": turns,
+            "dates": dates,
+            "available_seats": [available[i * width:(i + 1) * width] for i in range(days)],
+        })
+    except MySQLError as err:
+        logging.error(f"Error retrieving data: {err}")
+        return FastJSONResponse(content={"error": f"Error retrieving data: {err}"}, status_code=500)
+
+
+# one counter row per (locale, data, turno): its row lock serializes bookings of the same
+# slot only, bookings of different slots run in parallel
+reservationSlotSQL = """
+SELECT id_locale, data, id_turno, SUM(num_posti) AS posti_prenotati FROM prenota GROUP BY id_locale, data, id_turno
+"""
+
+
+class NotEnoughSeatsError(Exception):
+    pass
+
+
+# the commit of a reservation transaction failed: it may or may not have been applied, never retried
+class ReservationCommitError(mysql.connector.errors.DatabaseError):
+    pass
+
+
+@app.on_event("startup")
+async def create_reservation_slots():
+    def work(conn, cursor):
+        db_backend.create_table_as(cursor, "prenota_slot", reservationSlotSQL + " HAVING 1 = 0", ("id_locale", "data", "id_turno"))
+        conn.commit()
+    try:
+        await run_db(work, name="reservation_slots_create")
+    except MySQLError as e:
+        logger.error(f"Error creating reservation slots: {e}")
+
+
+# reserves qt seats on the slot row, False when they do not fit in posti_max
+def _take_seats(cursor, id, date, turn, qt):
+    cursor.execute(db_backend.takeSeatsSQL, (qt, id, date, turn, qt))
+    if cursor.rowcount == 1:
+        return True
+    # first booking of this slot: seed its counter from the existing reservations and retry
+    cursor.execute(
+        "INSERT IGNORE INTO prenota_slot (id_locale, data, id_turno, posti_prenotati) "
+        "SELECT %s, %s, %s, COALESCE(SUM(num_posti), 0) FROM prenota WHERE id_locale = %s AND data = %s AND id_turno = %s",
+        (id, date, turn, id, date, turn),
+    )
+    # retried even when the insert was ignored: a concurrent first booking may have just seeded the row
+    cursor.execute(db_backend.takeSeatsSQL, (qt, id, date, turn, qt))
+    return cursor.rowcount == 1
+
+
+def _reserve_seats_tx(conn, cursor, id, date, turn, qt, email):
+    if not _take_seats(cursor, id, date, turn, qt):
+        conn.rollback()
+        raise NotEnoughSeatsError()
+    cursor.execute(
+        "INSERT INTO prenota (mail_prenotazione,data,num_posti,id_turno,id_locale) VALUES (%s,%s,%s,%s,%s)",
+        (email, date, qt, turn, id),
+    )
+    try:
+        conn.commit()
+    except MySQLError as err:
+        raise ReservationCommitError(msg=f"Reservation commit failed: {err}") from err
+
+
+# atomic check-and-reserve, retried when InnoDB picks this transaction as a deadlock victim
+async def _reserve_seats_single(id, date, turn, qt, email):
+    for attempt in range(RESERVATION_RETRIES):
+        try:
+            await run_db(lambda conn, cursor: _reserve_seats_tx(conn, cursor, id, date, turn, qt, email), name="reservation_insert")
+            break
+        except MySQLError as err:
+            if err.errno not in (errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT) or attempt == RESERVATION_RETRIES - 1:
+                raise
+            logger.warning(f"Reservation retry {attempt + 1} after: {err}")
+    seat_counters.add(id, date, turn, qt)
+
+
+# all reservations of a batch in one transaction: per item check-and-reserve,
+# then one executemany and a single commit. Returns the outcome of every item.
+def _reserve_batch_tx(conn, cursor, items):
+    accepted = []
+    outcomes = {}
+    # fixed slot order, concurrent batches lock slot rows in the same order
+    for index in sorted(range(len(items)), key=lambda i: tuple(str(v) for v in items[i][:3])):
+        id, date, turn, qt, email = items[index]
+        outcomes[index] = _take_seats(cursor, id, date, turn, qt)
+        if outcomes[index]:
+            accepted.append((email, date, qt, turn, id))
+    if accepted:
+        cursor.executemany(
+            "INSERT INTO prenota (mail_prenotazione,data,num_posti,id_turno,id_locale) VALUES (%s,%s,%s,%s,%s)",
+            accepted,
+        )
+    try:
+        conn.commit()
+    except MySQLError as err:
+        raise ReservationCommitError(msg=f"Reservation batch commit failed: {err}") from err
+    return [outcomes[index] for index in range(len(items))]
+
+
+# group commit: reservations arriving within the batch window are written together
+class ReservationBatcher:
+    def __init__(self, window, max_size):
+        self.window = window
+        self.max_size = max_size
+        self.batches = 0
+        self.reservations = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self.size_counts = defaultdict(int)
+        self._pending = []
+        self._timer = None
+
+    async def submit(self, id, date, turn, qt, email):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(((id, date, turn, qt, email), future))
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.create_task(self._write(batch))
+
+    async def _write(self, batch):
+        items = [item for item, _ in batch]
+        self.batches += 1
+        self.reservations += len(batch)
+        self.size_counts[len(batch)] += 1
+        try:
+            outcomes = await run_db(lambda conn, cursor: _reserve_batch_tx(conn, cursor, items), name="reservation_batch")
+        except ReservationCommitError as exc:
+            self._fail(batch, exc)
+            return
+        except MySQLError:
+            # one bad row or a deadlock rolled the whole batch back: every caller gets its own transaction
+            self.fallbacks += 1
+            await asyncio.gather(*(self._write_single(item, future) for item, future in batch))
+            return
+        except Exception as exc:
+            # timeout included: the transaction may still commit in its db thread, a retry could book twice
+            self._fail(batch, exc)
+            return
+        for (item, future), accepted in zip(batch, outcomes):
+            # counted even when the caller went away, the seats are taken anyway
+            if accepted:
+                seat_counters.add(*item[:4])
+            if future.done():
+                continue
+            if accepted:
+                future.set_result(None)
+            else:
+                future.set_exception(NotEnoughSeatsError())
+
+    def _fail(self, batch, exc):
+        self.failures += 1
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(exc)
+
+    async def _write_single(self, item, future):
+        try:
+            await _reserve_seats_single(*item)
+        except Exception as exc:
+            if not future.done():
+                future.set_exception(exc)
+            return
+        if not future.done():
+            future.set_result(None)
+
+    def stats(self):
+        return {
+            "enabled": RESERVATION_BATCH,
+            "batches": self.batches,
+            "reservations": self.reservations,
+            "avg_batch_size": round(self.reservations / self.batches, 2) if self.batches else 0.0,
+            "max_batch_size": max(self.size_counts, default=0),
+            "fallbacks": self.fallbacks,
+            "failures": self.failures,
+            "batch_sizes": dict(sorted(self.size_counts.items())),
+        }
+
+
+reservation_batcher = ReservationBatcher(RESERVATION_BATCH_WINDOW_MS / 1000, RESERVATION_BATCH_MAX)
+
+
+async def reserve_seats(id, date, turn, qt, email):
+    if RESERVATION_BATCH:
+        await reservation_batcher.submit(id, date, turn, qt, email)
+    else:
+        await _reserve_seats_single(id, date, turn, qt, email)
 
 
 # booking table function
@@ -452,189 +2685,115 @@ async def check_tables(date: str, turn: str | int, id: str | int,token: str = De
 async def insert_reservation(request: Request, token: str = Depends(verify_token)):
     try:
         data = await request.json()
-        conn = get_db_connection()
         id, turn, date, qt, email = data.get("id"), data.get("turn"), data.get("date"), data.get("qt"), data.get("email")
-        cursor = conn.cursor(dictionary=True)
-        query = "INSERT INTO prenota (mail_prenotazione,data,num_posti,id_turno,id_locale) VALUES (%s,%s,%s,%s,%s)"
-        cursor.execute(query, (email, date, qt ,turn, id))
-        conn.commit()  # Assicurati di eseguire il commit per salvare le modifiche nel database
-        return JSONResponse(content={"message": "Reservation successfully inserted"},status_code=200)
+        try:
+            qt = int(qt)
+        except (TypeError, ValueError):
+            qt = 0
+        if qt < 1:
+            return FastJSONResponse(content={"error": "qt must be a positive number of seats"}, status_code=400)
+        error = await slot_error(date, turn)
+        if error:
+            return FastJSONResponse(content={"error": error}, status_code=400)
+        # an unknown id would otherwise fail the seat check as a full slot
+        if not await get_restaurant_row(id):
+            return FastJSONResponse(content={"error": "Restaurant not found"}, status_code=404)
+        await reserve_seats(id, date, turn, qt, email)
+        return FastJSONResponse(content={"message": "Reservation successfully inserted"},status_code=200)
+    except NotEnoughSeatsError:
+        return FastJSONResponse(content={"error": "Not enough seats available"}, status_code=409)
     except mysql.connector.Error as err:
-        return JSONResponse(content={"error": f"Error in retrieving data: {err}"}, status_code=500)
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        return FastJSONResponse(content={"error": f"Error in retrieving data: {err}"}, status_code=500)
+
+# many restaurants with their images in one call, rows shaped like GET /api/v1/restaurant
+@app.get("/api/v1/restaurant/batch")
+async def get_restaurant_batch(ids: List[int] = Query(...), fields: str = Query(None), token: str = Depends(verify_token)):
+    fields = parse_fields(fields, RESTAURANT_FIELDS)
+    if len(ids) > RESTAURANT_BATCH_MAX:
+        return FastJSONResponse(content={"error": f"At most {RESTAURANT_BATCH_MAX} ids per request"}, status_code=400)
+    try:
+        rows = await get_restaurant_rows(ids)
+        imgs = await fetch_imgs(list(rows))
+        ids = list(dict.fromkeys(str(id) for id in ids))
+        return FastJSONResponse(content={
+            "success": bool(rows),
+            "data": [project(rows[id], fields) for id in ids if id in rows],
+            "imgs": {id: imgs.get(id, []) for id in ids if id in rows},
+            "missing": [int(id) for id in ids if id not in rows],
+        })
+    except MySQLError as err:
+        raise HTTPException(status_code=400, detail=f"Error retriving data: {err}")
 
 # get all imgs url 
 @app.get("/api/v1/imgs")
 async def get_all_imgs(id: str = Query(..., description="ID locale"), token: str = Depends(verify_token)): 
     try: 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
         query = "SELECT * FROM imgs WHERE id_locale = %s"
-        cursor.execute(query, (id,))
-        result = cursor.fetchall()
-        return JSONResponse(content = result)
+        result = await db_fetchall(query, (id,), name="imgs")
+        return FastJSONResponse(content = result)
     except mysql.connector.Error as err:
-        return JSONResponse(content={"Error": f"Error in retrieving data: {err}"},status_code=400)
-        
-    finally: 
-        cursor.close()
-        conn.close()
+        return FastJSONResponse(content={"Error": f"Error in retrieving data: {err}"},status_code=400)
         
 # get nearest restaurants by location
 @app.get("/api/v1/restaurant/nearest")
-async def get_nearest(village: str = Query(""),county: str = Query(""), state: str = Query(""), token: str = Depends(verify_token)): 
+async def get_nearest(village: str = Query(""),county: str = Query(""), state: str = Query(""), fields: str = Query(None), token: str = Depends(verify_token)): 
+    fields = parse_fields(fields, CARD_FIELDS)
     try: 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        query = baseSQL + " WHERE "
-        
-        conditions = []
-        if village:
-            conditions.append(f"c.nome LIKE '{village}'")
-        if county:
-            conditions.append(f"p.nome LIKE '{county}'")
-        if state:
-            conditions.append(f"r.nome LIKE '{state}'")
-        
-        # Unisci le condizioni con AND
-        query += " AND ".join(conditions)
-        query += " GROUP BY l.id"
-        
-        cursor.execute(query)
-        result = cursor.fetchall()
+        # nomi risolti in id dall'indice geografico, poi lookup per id
+        index = await get_geo_index()
+        comuni = index.comuni(village, county, state)
+        result = await single_flight.do(
+            ("nearest", normalize_text(village), normalize_text(county), normalize_text(state), fields),
+            lambda: fetch_restaurants(index.restaurants(comuni or ()), fields),
+        )
         if result: 
             response = {"success" : True, "data": result}
         else: 
             response = {"success" : False}
         
-        return JSONResponse(content = response)
+        return FastJSONResponse(content = response)
         
     except mysql.connector.Error as err:
-        return JSONResponse(content={"Error": f"Error in retrieving data: {err}"},status_code=400)
-    finally: 
-        cursor.close()
-        conn.close()
+        return FastJSONResponse(content={"Error": f"Error in retrieving data: {err}"},status_code=400)
         
         
 #get others restaurant in same county or village
 @app.post("/api/v1/get_others")
-async def get_others(request: Request, token: str = Depends(verify_token)):
-    conn = None
-    cursor = None
+async def get_others(request: Request, fields: str = Query(None), token: str = Depends(verify_token)):
+    fields = parse_fields(fields, CARD_FIELDS)
     try:
         data = await request.json()
         ids = data.get("ids")
         village = data.get("village")
         county = data.get("county")
-        
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
 
-        # Constructing the SQL query
-        query = baseSQL + """
-         WHERE (p.nome = %s OR c.nome = %s)
-        AND l.id NOT IN ({}) GROUP BY l.id
-        """.format(','.join(['%s'] * len(ids)))
-
-        params = [county, village] + ids
-
-        cursor.execute(query, params)
-        result = cursor.fetchall()
+        result = await fetch_restaurants_near(village, county, ids, fields)
 
-        return JSONResponse(content=result)
+        return FastJSONResponse(content=result)
     except mysql.connector.Error as err:
-        return JSONResponse(content={"Error": f"Error in retrieving data: {err}"}, status_code=400)
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        return FastJSONResponse(content={"Error": f"Error in retrieving data: {err}"}, status_code=400)
             
-#get email from token and get user
-# importa le librerie necessarie
-from fastapi import Depends, HTTPException
-from mysql.connector import connect, Error
-from fastapi.responses import JSONResponse
-from jose import jwt, JWTError
-from datetime import datetime, timedelta
-
-
-# Funzione per ottenere l'email dal token JWT
-async def get_email_from_token(token: str = Depends(verify_token)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Email non trovata nel token")
-        return email
-    except JWTError as e:
-        raise HTTPException(status_code=401, detail="Token JWT non valido")
-
-
-# Configurazione del logger
-logging.basicConfig(level=logging.INFO)
-
-
-from fastapi import Header
-async def get_email_from_token(authorization: str = Header(None)):
-    try:
-        if authorization is None:
-            raise HTTPException(status_code=401, detail="Missing Authorization header")
-        
-        # Divide l'header in schema e token solo se presente lo spazio
-        auth_parts = authorization.split()
-        if len(auth_parts) != 2:
-            raise HTTPException(status_code=401, detail="Invalid Authorization header format")
-        
-        scheme, token = auth_parts
-        
-        if scheme.lower() != "bearer":
-            raise HTTPException(status_code=401, detail="Invalid authorization scheme")
-        
-        # Verifica la firma del token e ottieni il payload
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise HTTPException(status_code=401, detail="Email non trovata nel token")
-        
-        return email
-    except JWTError as e:
-        raise HTTPException(status_code=401, detail="Token JWT non valido")
-
-
 @app.get("/api/v1/user")
-async def get_user_from_email(email: str = Depends(get_email_from_token)):
-    conn = None
+async def get_user_from_email(email: str = Depends(verify_token)):
     try:
         logging.debug("Connessione al database...")
-        conn = get_db_connection()
-
-        cursor = conn.cursor(dictionary=True)
         query = "SELECT * FROM CLIENTE WHERE mail = %s"
-        cursor.execute(query, (email.lower(),))  # email dovrebbe essere una tupla
-        result = cursor.fetchone()
+        result = await db_fetchone(query, (email.lower(),), name="user_by_mail")  # email dovrebbe essere una tupla
         
-        user = {
-                "mail" : result["mail"],
-                "nome" : result["nome"],
-                "cognome" : result["cognome"]
-            }
         if result: 
+            user = {
+                    "mail" : result["mail"],
+                    "nome" : result["nome"],
+                    "cognome" : result["cognome"]
+                }
             logging.debug("Utente trovato nel database")
-            return JSONResponse(content=user)
+            return FastJSONResponse(content=user)
         else:
             logging.error("Utente non trovato nel database")
             raise HTTPException(status_code=404, detail="Utente non trovato")
-    except Error as err:
+    except MySQLError as err:
         logging.error(f"Errore nel recupero dei dati dal database: {err}")
         raise HTTPException(status_code=400, detail=f"Errore nel recupero dei dati: {err}")
-    finally:
-        if conn:
-            conn.close()
             
             
 @app.patch("/api/v1/user")
@@ -645,81 +2804,55 @@ async def patch_user(request: Request, token: str = Depends(verify_token)):
         surname = data.get("surname")
         mail = data.get("mail")
 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        
         query = "UPDATE cliente SET nome = %s, cognome = %s WHERE mail = %s"
-        cursor.execute(query, (name, surname, mail))
-        conn.commit()
+        updated = await db_execute(query, (name, surname, mail), name="user_update")
         
-        if cursor.rowcount > 0:
-            return JSONResponse(content={"success": True})
+        if updated > 0:
+            return FastJSONResponse(content={"success": True})
         else: 
-            return JSONResponse(content={"success": False})
+            return FastJSONResponse(content={"success": False})
         
     except MySQLError as err: 
         raise HTTPException(status_code=400, detail=f"Errore nel recupero dei dati: {err}")
-    finally: 
-        if conn.is_connected():
-            conn.close()
         
 @app.get("/api/v1/user/reservation")
 async def get_user_reservation(mail: str): 
     try: 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
         query = ""
         
     except: 
         return
-    finally: 
-        conn.close()
         
         
 @app.get("/api/v1/restaurant")
-async def get_from_id(id: int | str, token: str = Depends(verify_token)): 
+async def get_from_id(id: int | str, fields: str = Query(None), token: str = Depends(verify_token)): 
+    fields = parse_fields(fields, RESTAURANT_FIELDS)
     try:    
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary = True)
-        query = baseSQL + " WHERE l.id = %s GROUP BY l.id"
-        cursor.execute(query,(id,))
-        result = cursor.fetchone()
+        result = project(await get_restaurant_row(id), fields)
         
         if result: 
             response = {"success": True, "data": result }
         else: 
             response = {"success": False}
         
-        return JSONResponse(content = response)
+        return FastJSONResponse(content = response)
     except MySQLError as err: 
         raise HTTPException(status_code=400, detail= f"Error retriving data: {err}")
-    finally: 
-        conn.close()
         
         
 @app.get("/api/v1/restaurant/others")
-async def get_others(ids: List[int] = Query(...), county: str = Query(""), village: str = Query(""), token = Depends(verify_token)): 
+async def get_others(ids: List[int] = Query(...), county: str = Query(""), village: str = Query(""), fields: str = Query(None), token = Depends(verify_token)): 
+    fields = parse_fields(fields, CARD_FIELDS)
     try: 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        query = baseSQL + """
-         WHERE (p.nome = %s OR c.nome = %s)
-        AND l.id NOT IN ({}) GROUP BY l.id
-        """.format(','.join(['%s'] * len(ids)))
-
-        params = [county, village] + ids
-        cursor.execute(query, params)
-        result = cursor.fetchall()
+        result = await fetch_restaurants_near(village, county, ids, fields)
         
         if result: 
             response = {"success": True, "data": result }
         else: 
             response = {"success": False}
-        return JSONResponse(content = response)
+        return FastJSONResponse(content = response)
     except MySQLError as err:
         raise HTTPException(status_code=400, detail=f"Error: {err}")
-    finally: 
-        conn.close()
         
         
 @app.put("/api/v1/restaurant")
@@ -734,8 +2867,6 @@ async def put_restaurant(request: Request, token:str = Depends(verify_token),id:
     description = data.get("description")
     banner = data.get("banner")
     try: 
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
         query_parts = []
         params = []
 
@@ -764,116 +2895,242 @@ async def put_restaurant(request: Request, token:str = Depends(verify_token),id:
         query = "UPDATE locale SET " + ", ".join(query_parts)
         query += " WHERE id = %s"
         params.append(id)
-        cursor.execute(query, params)
-        conn.commit()
+        updated = await db_execute(query, params, name="restaurant_update")
+        if updated > 0:
+            await restaurant_changed(id)
         
         logging.info(query)
-        if cursor.rowcount > 0 : 
+        if updated > 0 : 
             response = {"success": True}
         else : 
             response = {"success": False}
-        return JSONResponse(content = response)
+        return FastJSONResponse(content = response)
     except MySQLError as err: 
         raise HTTPException(status_code=400, detail= f"Error: {err}")
-    finally: 
-        conn.close()
         
+menuSQL = """
+    SELECT menu.id_locale id_locale,
+        menu.nome nome_menu, 
+        menu.id id_menu,
+        piatto.nome nome_piatto,
+        piatto.id id_piatto,
+        piatto.descrizione descrizione_piatto,
+        piatto.ingredienti ingredienti_piatto
+    FROM menu 
+    INNER JOIN piatto ON piatto.id_menu = menu.id
+"""
+
+#menus are cached as serialized JSON bytes: per restaurant ("restaurant", id) and per menu ("menu", id);
+#menu and piatto are written outside the api, changes show up after MENU_CACHE_TTL or an admin reload
+menu_cache = LRUCache(MENU_CACHE_SIZE, ttl=MENU_CACHE_TTL, max_bytes=MENU_CACHE_MAX_BYTES)
+menu_cache_generation = 0
+
+
+def _course(row):
+    return {
+        "course_id": row["id_piatto"],
+        "course_name": row["nome_piatto"],
+        "course_description": row["descrizione_piatto"],
+        "course_ingredients": row["ingredienti_piatto"]
+    }
+
+
+# groups menu/piatto rows into menus, per restaurant
+def _group_menus(rows):
+    restaurants = defaultdict(lambda: defaultdict(lambda: {"menu_id": None, "menu_name": "", "courses": []}))
+    for row in rows:
+        menu = restaurants[str(row["id_locale"])][row["nome_menu"]]
+        menu["menu_id"] = row["id_menu"]
+        menu["menu_name"] = row["nome_menu"]
+        menu["courses"].append(_course(row))
+    # Convertiamo il defaultdict in una lista di oggetti
+    return {id: list(menus.values()) for id, menus in restaurants.items()}
+
+
+# menus of many restaurants as {str(id): bytes}, cached ones skip the query
+async def get_restaurant_menus(ids):
+    ids = list(dict.fromkeys(str(id) for id in ids))
+    found = {}
+    missing = []
+    for id in ids:
+        body = menu_cache.get(("restaurant", id))
+        if body is None:
+            missing.append(id)
+        else:
+            found[id] = body
+    if missing:
+        generation = menu_cache_generation
+        placeholders = ",".join(["%s"] * len(missing))
+        rows = await single_flight.do(
+            ("menus", generation) + tuple(missing),
+            lambda: db_fetchall(menuSQL + f" WHERE menu.id_locale IN ({placeholders}) ORDER BY menu.id, piatto.id", tuple(missing), name="menus_by_restaurant"),
+        )
+        grouped = _group_menus(rows)
+        for id in missing:
+            found[id] = json_dumps(grouped.get(id, []))
+            if generation == menu_cache_generation:
+                menu_cache.set(("restaurant", id), found[id], size=len(found[id]))
+    return {id: found[id] for id in ids}
+
+
+def _menu_response(body):
+    if body == b"[]":
+        return Response(content=b'{"success":false,"data":[]}', media_type="application/json")
+    return Response(content=b'{"success":true,"data":' + body + b"}", media_type="application/json")
+
+
 @app.get("/api/v1/restaurant/menu")
 async def get_all_menu(token=Depends(verify_token), id: int = Query("")):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        query = """ 
-            SELECT menu.nome nome_menu, 
-                menu.id id_menu,
-                piatto.nome nome_piatto,
-                piatto.id id_piatto,
-                piatto.descrizione descrizione_piatto,
-                piatto.ingredienti ingredienti_piatto
-            FROM menu 
-            INNER JOIN locale on menu.id_locale = locale.id 
-            INNER JOIN piatto ON piatto.id_menu = menu.id
-            WHERE locale.id = %s
-        """
-        cursor.execute(query, (id,))
-        result = cursor.fetchall()
-        
-        if result:
-            menus = defaultdict(lambda: {"menu_id": None, "menu_name": "", "courses": []})
-            for row in result:
-                course = {
-                    "course_id": row["id_piatto"],
-                    "course_name": row["nome_piatto"],
-                    "course_description": row["descrizione_piatto"],
-                    "course_ingredients": row["ingredienti_piatto"]
-                }
-                menu = menus[row["nome_menu"]]
-                menu["menu_id"] = row["id_menu"]
-                menu["menu_name"] = row["nome_menu"]
-                menu["courses"].append(course)
-            
-            # Convertiamo il defaultdict in una lista di oggetti
-            menu_list = list(menus.values())
-            
-            response = {
-                "success": True,
-                "data": menu_list
-            }
-        else:
-            response = {
-                "success": False,
-                "data": []
-            }
-        return JSONResponse(content=response)
+        menus = await get_restaurant_menus([id])
+        return _menu_response(menus[str(id)])
+    except MySQLError as err:
+        raise HTTPException(status_code=400, detail=f"Error: {err}")
+
+#menus of many restaurants in one call: {"success": true, "data": {"<id>": [menus]}}
+@app.get("/api/v1/restaurant/menus")
+async def get_many_menus(ids: List[int] = Query(...), token=Depends(verify_token)):
+    if len(ids) > MENU_BATCH_MAX:
+        return FastJSONResponse(content={"error": f"At most {MENU_BATCH_MAX} ids per request"}, status_code=400)
+    try:
+        menus = await get_restaurant_menus(ids)
+        data = b",".join(b'"' + id.encode() + b'":' + body for id, body in menus.items())
+        return Response(content=b'{"success":true,"data":{' + data + b"}}", media_type="application/json")
     except MySQLError as err:
         raise HTTPException(status_code=400, detail=f"Error: {err}")
-    finally:
-        conn.close()
 
 @app.get("/api/v1/menu")
 async def get_menu(id: int | str = Query("")):
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-        query = """
-            SELECT menu.id id_menu,
-                menu.nome nome_menu,
-                piatto.nome nome_piatto,
-                piatto.id id_piatto,
-                piatto.descrizione descrizione_piatto,
-                piatto.ingredienti ingredienti_piatto 
-            FROM menu 
-            INNER JOIN piatto ON piatto.id_menu = menu.id 
-            WHERE menu.id = %s
-        """
-        cursor.execute(query, (id,))
-        result = cursor.fetchall()
-        
-        if result:
+        key = ("menu", str(id))
+        body = menu_cache.get(key)
+        if body is None:
+            generation = menu_cache_generation
+            result = await db_fetchall(menuSQL + " WHERE menu.id = %s ORDER BY piatto.id", (id,), name="menu_by_id")
             menus = defaultdict(list)
             for row in result:
-                course = {
-                    "course_id": row["id_piatto"],
-                    "course_name": row["nome_piatto"],
-                    "course_description": row["descrizione_piatto"],
-                    "course_ingredients": row["ingredienti_piatto"]
-                }
-                menus[row["nome_menu"]].append(course)
+                menus[row["nome_menu"]].append(_course(row))
                 
             # Convertiamo il defaultdict in una lista di oggetti
             menu_list = [{"menu_name": menu_name, "courses": courses} for menu_name, courses in menus.items()]
-            
-            response = {
-                "success": True,
-                "data": menu_list
-            }
-        else:
-            response = {
-                "success": False,
-                "data": []
-            }
-        return JSONResponse(content=response)
+            body = json_dumps(menu_list)
+            if generation == menu_cache_generation:
+                menu_cache.set(key, body, size=len(body))
+        return _menu_response(body)
     except MySQLError as err:
         raise HTTPException(status_code=400, detail=f"Error: {err}")
-    finally:
-        conn.close()
\ No newline at end of file
+
+
+# invalidation log shared by the workers of a node: each change is applied locally at once and
+# published, the other workers apply it within SHARED_STATE_POLL. Cached values stay per worker.
+class SharedEventLog:
+    def __init__(self, path):
+        self.path = path
+        self.origin = f"{os.getpid()}-{secrets.token_hex(4)}"
+        self.published = 0
+        self.applied = 0
+        self.resyncs = 0
+        self._lock = threading.Lock()
+        # one thread: sqlite waits stay off the event loop and publishes keep their order
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+        self._conn = sqlite3.connect(path, timeout=1, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode = WAL")
+        self._conn.execute("PRAGMA synchronous = OFF")  # lost on reboot only, like the caches it protects
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS events (seq INTEGER PRIMARY KEY AUTOINCREMENT, origin TEXT, kind TEXT, key TEXT, at REAL)"
+        )
+        self.last_seq = self._conn.execute("SELECT COALESCE(MAX(seq), 0) FROM events").fetchone()[0]
+
+    def publish(self, kind, key=None):
+        with self._lock:
+            self._conn.execute("INSERT INTO events (origin, kind, key, at) VALUES (?, ?, ?, ?)", (self.origin, kind, key, time.time()))
+            self.published += 1
+
+    # events of the other workers since the last poll; missed is True when some were pruned unread
+    def poll(self):
+        with self._lock:
+            oldest = self._conn.execute("SELECT MIN(seq) FROM events").fetchone()[0]
+            missed = oldest is not None and oldest > self.last_seq + 1
+            rows = self._conn.execute(
+                "SELECT seq, origin, kind, key FROM events WHERE seq > ? ORDER BY seq", (self.last_seq,)
+            ).fetchall()
+            if rows:
+                self.last_seq = rows[-1][0]
+        return [(kind, key) for _, origin, kind, key in rows if origin != self.origin], missed
+
+    def prune(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM events WHERE at < ?", (time.time() - SHARED_STATE_RETENTION,))
+
+    def stats(self):
+        return {"origin": self.origin, "last_seq": self.last_seq, "published": self.published,
+                "applied": self.applied, "resyncs": self.resyncs}
+
+
+shared_events = SharedEventLog(SHARED_STATE_PATH) if SHARED_STATE_PATH else None
+
+
+def _publish(kind, key):
+    try:
+        shared_events.publish(kind, key)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not publish {kind} change: {e}")
+
+
+# fire and forget, called from the request path (every reservation publishes its slot)
+def publish_change(kind, key=None):
+    if shared_events is None:
+        return
+    try:
+        shared_events.executor.submit(_publish, kind, key)
+    except RuntimeError:
+        logger.warning(f"Could not publish {kind} change: shutting down")
+
+
+async def apply_shared_change(kind, key):
+    if kind == "restaurant":
+        await apply_restaurant_change(key)
+    elif kind == "seats":
+        seat_counters.invalidate(tuple(json.loads(key)))
+    elif kind == "reload":
+        await apply_reload()
+
+
+async def resync_local_state():
+    seat_counters.clear()
+    await apply_reload()
+
+
+async def sync_shared_state_forever():
+    loop = asyncio.get_running_loop()
+    last_prune = time.monotonic()
+    while True:
+        await asyncio.sleep(SHARED_STATE_POLL)
+        try:
+            events, missed = await loop.run_in_executor(shared_events.executor, shared_events.poll)
+            if missed:
+                # this worker fell behind the retention window: rebuild everything that may be stale
+                shared_events.resyncs += 1
+                await resync_local_state()
+            for kind, key in events:
+                await apply_shared_change(kind, key)
+                shared_events.applied += 1
+            if time.monotonic() - last_prune > SHARED_STATE_RETENTION:
+                await loop.run_in_executor(shared_events.executor, shared_events.prune)
+                last_prune = time.monotonic()
+        except Exception as e:
+            logger.error(f"Error applying shared state changes: {e}")
+
+
+@app.on_event("startup")
+async def start_shared_state_sync():
+    if shared_events is not None:
+        app.state.shared_state_task = asyncio.create_task(sync_shared_state_forever())
+
+
+@app.on_event("shutdown")
+async def stop_shared_state_sync():
+    if shared_events is not None:
+        app.state.shared_state_task.cancel()
+        # flushes the changes still queued for the other workers
+        shared_events.executor.shutdown(wait=True)
@@ -0,0 +1,18 @@
+#bcrypt hashing, imported by the password worker processes: keep it free of app, db and key side effects
+import os
+
+from passlib.context import CryptContext
+
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", 12))
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+
+
+# module level so they can be pickled to the workers
+def hash_password(password):
+    return pwd_context.hash(password)
+
+
+def verify_password(password, hashed):
+    # new hash is not None when the stored one was made with a different cost factor
+    return pwd_context.verify_and_update(password, hashed)
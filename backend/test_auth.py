@@ -0,0 +1,18 @@
+#regression tests for token signing, on the sqlite backend (see conftest.py)
+#usage: python -m pytest -q test_auth.py
+import asyncio
+
+import main
+
+
+# with no JWT_KEYFILE/JWT_KEYS the key is per process: a reference data reload must not replace it
+def test_token_survives_reload(monkeypatch):
+    async def noop():
+        pass
+
+    for loader in ("load_reference_data", "load_geo_index", "build_search_index"):
+        monkeypatch.setattr(main, loader, noop)
+    token = main.create_access_token({"sub": "user@test.local"})
+    asyncio.run(main.apply_reload())
+    main.token_cache.clear()  # checked against the signing key, not the cached claims
+    assert main.decode_token(token)["sub"] == "user@test.local"
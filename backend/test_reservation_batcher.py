@@ -0,0 +1,108 @@
+#regression tests for the reservation group commit, on the sqlite backend (see conftest.py)
+#usage: python -m pytest -q test_reservation_batcher.py
+import asyncio
+import time
+
+import pytest
+
+import main
+
+SLOT = (1, "2030-01-01", 1)
+
+
+@pytest.fixture(autouse=True)
+def database():
+    conn = main.db_backend.connect()
+    cursor = conn.cursor()
+    for table in ("prenota_slot", "prenota", "locale"):
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+    cursor.execute("CREATE TABLE locale (id INT PRIMARY KEY, posti_max INT)")
+    cursor.execute("CREATE TABLE prenota (id INTEGER PRIMARY KEY, mail_prenotazione TEXT, data DATE, num_posti INT, id_turno INT, id_locale INT)")
+    cursor.execute("INSERT INTO locale (id, posti_max) VALUES (%s, %s)", (SLOT[0], 50))
+    conn.commit()
+    conn.close()
+    asyncio.run(main.create_reservation_slots())
+    main.seat_counters.clear()
+    yield
+    main.db_pool.close()
+
+
+def prenota_rows():
+    conn = main.db_backend.connect()
+    cursor = conn.cursor()
+    cursor.execute("SELECT mail_prenotazione FROM prenota ORDER BY mail_prenotazione")
+    rows = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+# a batch outliving DB_QUERY_TIMEOUT still commits in its thread: callers fail, nothing is booked twice
+def test_timed_out_batch_is_not_retried(monkeypatch):
+    reserve_batch_tx = main._reserve_batch_tx
+
+    def slow_batch(conn, cursor, items):
+        time.sleep(0.6)
+        return reserve_batch_tx(conn, cursor, items)
+
+    monkeypatch.setattr(main, "_reserve_batch_tx", slow_batch)
+    monkeypatch.setattr(main, "DB_QUERY_TIMEOUT", 0.3)
+    batcher = main.ReservationBatcher(0.01, 10)
+
+    async def book():
+        results = await asyncio.gather(
+            *(batcher.submit(*SLOT, 2, f"user{i}@test.local") for i in range(3)), return_exceptions=True
+        )
+        await asyncio.sleep(0.6)  # let the abandoned transaction finish
+        return results
+
+    results = asyncio.run(book())
+    assert all(isinstance(result, main.QueryTimeoutError) for result in results)
+    assert batcher.fallbacks == 0
+    assert prenota_rows() == ["user0@test.local", "user1@test.local", "user2@test.local"]
+
+
+# an accepted booking whose caller went away still counts in the seat counters
+def test_abandoned_caller_is_counted():
+    batcher = main.ReservationBatcher(0.05, 10)
+
+    async def book():
+        assert await main.seat_counters.reserved(*SLOT) == 0
+        caller = asyncio.ensure_future(batcher.submit(*SLOT, 4, "gone@test.local"))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0.3)
+        return await main.seat_counters.reserved(*SLOT)
+
+    assert asyncio.run(book()) == 4
+    assert prenota_rows() == ["gone@test.local"]
+
+
+# the seeding insert is ignored when a concurrent first booking created the row: the update still runs
+def test_take_seats_after_concurrent_seed():
+    class RacedCursor:
+        def __init__(self):
+            self.statements = []
+
+        def execute(self, query, params=()):
+            self.statements.append(query.split()[0])
+            # update misses (no row yet), insert ignored (row just seeded elsewhere), update hits
+            self.rowcount = {1: 0, 2: 0, 3: 1}[len(self.statements)]
+
+    cursor = RacedCursor()
+    assert main._take_seats(cursor, *SLOT, 2)
+    assert cursor.statements == ["UPDATE", "INSERT", "UPDATE"]
+
+
+# a booking during the hydrating read: one query, its value answered but not cached
+def test_raced_hydration_is_not_cached(monkeypatch):
+    queries = []
+
+    async def racing_fetchone(query, params, **kwargs):
+        queries.append(params)
+        main.seat_counters.add(*SLOT, 1)
+        return (5,)
+
+    monkeypatch.setattr(main, "db_fetchone", racing_fetchone)
+    assert asyncio.run(main.seat_counters.reserved(*SLOT)) == 5
+    assert len(queries) == 1
+    assert main.seat_counters.stats()["slots"] == 0